@@ -0,0 +1,334 @@
+"""
+Benchmark harness for IG, MSIG and the modularity backends.
+
+Runs every algorithm on the LFR mixing-parameter sweep (data/synth/LFR) and on the reel datasets
+(data/reel), and writes a JSON report with, for each run: wall time, peak RSS, iterations per
+second, modularity and NMI against the ground truth. Comparing two reports with `compare_reports`
+shows the regressions between two versions of the code.
+
+Usage, from the python folder:
+    python -m utils.benchmark --output benchmark.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import networkx as nx
+import numpy as np
+from utils import ig_kernels
+from utils.communities_network import (calc_nmi, communities_to_label_vector, communities_to_labels, labels_modularity,
+                                       label_vector_to_communities, modularity_matrix)
+from utils.iterative_greedy_algorithm import GCP, IG, msig
+from utils.modularity_engine import ModularityEngine
+from utils.partition import Partition
+from utils.utils import read_community_labels_file_reel, read_community_labels_file_synth
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data")
+
+ALGORITHMS = ("IG", "IG+local_search", "MSIG", "GCP/numpy", "GCP/numba",
+              "modularity/labels", "modularity/partition", "modularity/engine", "modularity/dense")
+
+
+def load_datasets(data_dir=DATA_DIR, groups=("lfr", "reel")) -> list:
+    """
+    Lists the benchmark datasets with their ground truth.
+
+    Parameters:
+        data_dir (str): The data folder of the project. Default is the one of the repository.
+        groups (list): "lfr" for the LFR mixing sweep, "reel" for the real networks. Default is both.
+
+    Returns:
+        list: One dictionary per dataset with its name, the network file and the ground truth file.
+    """
+    datasets = []
+
+    if "lfr" in groups:
+        lfr_dir = os.path.join(data_dir, "synth", "LFR")
+        for mixing in sorted(os.listdir(lfr_dir)):
+            folder = os.path.join(lfr_dir, mixing)
+            datasets.append({"name": f"LFR/{mixing}", "kind": "lfr",
+                             "network": os.path.join(folder, "network.dat"),
+                             "ground_truth": os.path.join(folder, "community.dat")})
+
+    if "reel" in groups:
+        reel_dir = os.path.join(data_dir, "reel")
+        for name in sorted(os.listdir(reel_dir)):
+            folder = os.path.join(reel_dir, name)
+            datasets.append({"name": f"reel/{name}", "kind": "reel",
+                             "network": os.path.join(folder, f"{name}.gml"),
+                             "ground_truth": os.path.join(folder, "groundTruth.txt")})
+
+    return datasets
+
+
+def read_dataset(dataset: dict) -> tuple:
+    """
+    Reads a dataset listed by `load_datasets`, like the notebooks do.
+
+    Returns:
+        tuple: The networkx graph, its sparse adjacency matrix and the ground truth labels.
+    """
+    if dataset["kind"] == "lfr":
+        G = nx.read_edgelist(dataset["network"], nodetype=int)
+        true_labels = read_community_labels_file_synth(dataset["ground_truth"])
+    else:
+        G = nx.read_gml(dataset["network"], label="id")
+        true_labels = read_community_labels_file_reel(dataset["ground_truth"])
+
+    return G, nx.to_scipy_sparse_array(G, format="csr"), true_labels
+
+
+def _rss_mb(field="VmRSS") -> float:
+    """
+    Resident set size of the process (VmRSS), or its peak since the last `_reset_peak_rss` (VmHWM), in MB.
+
+    Where /proc is not available, both are the peak resident set size of the whole life of the process.
+    """
+    try:
+        with open("/proc/self/status") as file:
+            for line in file:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak / (1024 ** 2 if sys.platform == "darwin" else 1024)
+
+
+def _reset_peak_rss() -> None:
+    """
+    Resets the peak resident set size of the process to its current size (Linux only).
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as file:
+            file.write("5")
+    except OSError:
+        pass
+
+
+def _dense_modularity(adj_matrix, labels: np.ndarray) -> float:
+    """
+    Modularity from the dense modularity matrix, the original O(N^2) definition of `modularity`.
+    """
+    B = modularity_matrix(adj_matrix.toarray())
+    same = labels[:, None] == labels[None, :]
+    np.fill_diagonal(same, False)
+
+    return 0.5 * B[same].sum()
+
+
+def _run_case(dataset: dict, algorithm: str, nb_iterations: int, beta: float, nb_restarts: int, repeats: int,
+              seed: int) -> dict:
+    """
+    Runs one algorithm on one dataset, in a fresh worker process so that the peak RSS is its own.
+    The peak RSS is the one of the timed run, above the RSS of the worker just before it.
+    """
+    G, adj_matrix, true_labels = read_dataset(dataset)
+    n = adj_matrix.shape[0]
+
+    if algorithm.startswith("GCP/"):
+        # the worker process only runs this case, the switch does not leak
+        ig_kernels.NUMBA_AVAILABLE = algorithm == "GCP/numba"
+
+    # compiles (or loads) the Numba kernels before the clock starts
+    GCP(adj_matrix, seed)
+
+    # the modularity backends are timed on the same GCP partition
+    if algorithm.startswith("modularity/"):
+        communities, _ = GCP(adj_matrix, seed)
+        labels = communities_to_label_vector(n, communities)
+        engine = ModularityEngine(adj_matrix)
+        partition = Partition.from_labels(adj_matrix, labels)
+
+    # the peak of the run is measured above the memory of the worker once the graph is loaded and the
+    # kernels are compiled, the worker processes of MSIG are not included
+    _reset_peak_rss()
+    rss_before = _rss_mb()
+
+    start = time.perf_counter()
+
+    if algorithm in ("IG", "IG+local_search"):
+        communities, _, _, _ = IG(adj_matrix, nb_iterations, beta, progress=False, seed=seed, record="none",
+                                  local_search=algorithm == "IG+local_search")
+        iterations = nb_iterations
+    elif algorithm == "MSIG":
+        communities, _ = msig(adj_matrix, nb_restarts, nb_iterations, beta, seed=seed)
+        iterations = nb_restarts * nb_iterations
+    elif algorithm.startswith("GCP/"):
+        engine = ModularityEngine(adj_matrix)
+        for _ in range(repeats):
+            communities, _ = GCP(adj_matrix, seed, engine)
+        iterations = repeats
+    else:
+        for _ in range(repeats):
+            if algorithm == "modularity/labels":
+                labels_modularity(adj_matrix, labels)
+            elif algorithm == "modularity/partition":
+                partition.modularity(adj_matrix)
+            elif algorithm == "modularity/engine":
+                engine.reset(labels)
+                engine.modularity()
+            else:
+                _dense_modularity(adj_matrix, labels)
+        iterations = repeats
+
+    wall_time = time.perf_counter() - start
+    peak_rss = _rss_mb("VmHWM") - rss_before
+
+    labels = communities_to_label_vector(n, communities)
+
+    return {
+        "dataset": dataset["name"],
+        "algorithm": algorithm,
+        "nb_nodes": n,
+        "nb_edges": G.number_of_edges(),
+        "wall_time_s": wall_time,
+        "peak_rss_mb": peak_rss,
+        "iterations": iterations,
+        "iterations_per_s": iterations / wall_time if wall_time > 0 else None,
+        "modularity": labels_modularity(adj_matrix, labels),
+        "nmi": calc_nmi(true_labels, communities_to_labels(G, label_vector_to_communities(labels))),
+        "nb_communities": len(communities),
+    }
+
+
+def _metadata(parameters: dict) -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+
+    return {
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "numba": ig_kernels.NUMBA_AVAILABLE,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "parameters": parameters,
+    }
+
+
+def run_benchmark(output=None, groups=("lfr", "reel"), algorithms=ALGORITHMS, nb_iterations=50, beta=.4,
+                  nb_restarts=4, repeats=20, seed=0, data_dir=DATA_DIR, progress=True) -> dict:
+    """
+    Runs every algorithm on every dataset and builds the benchmark report.
+
+    Each (dataset, algorithm) pair runs in its own process, spawned for it only, so that the
+    peak RSS of a run does not include the memory of the previous ones nor of this process. The modularity and
+    the NMI of the modularity backends are the ones of the GCP partition they are timed on.
+
+    Parameters:
+        output (str): Path of the JSON report. Default is None (not written).
+        groups (list): The dataset groups, see `load_datasets`. Default is ("lfr", "reel").
+        algorithms (list): The algorithms to run, among `ALGORITHMS`. Default is all of them
+                           (GCP/numba is skipped when Numba is not installed).
+        nb_iterations (int): Number of iterations of IG and of each MSIG restart. Default is 50.
+        beta (float): Beta parameter of IG. Default is 0.4.
+        nb_restarts (int): Number of MSIG restarts. Default is 4.
+        repeats (int): Number of evaluations timed for GCP and the modularity backends. Default is 20.
+        seed (int): Seed of every run. Default is 0.
+        data_dir (str): The data folder of the project. Default is the one of the repository.
+        progress (bool): Whether to print each result as it is obtained. Default is True.
+
+    Returns:
+        dict: The report, with the run metadata and one result per (dataset, algorithm) pair.
+    """
+    unknown = set(algorithms) - set(ALGORITHMS)
+    if unknown:
+        raise ValueError(f"unknown algorithms {sorted(unknown)}, expected some of {ALGORITHMS}")
+
+    parameters = {"groups": list(groups), "algorithms": list(algorithms), "nb_iterations": nb_iterations,
+                  "beta": beta, "nb_restarts": nb_restarts, "repeats": repeats, "seed": seed}
+
+    if not ig_kernels.NUMBA_AVAILABLE:
+        algorithms = [algorithm for algorithm in algorithms if algorithm != "GCP/numba"]
+
+    results = []
+    for dataset in load_datasets(data_dir, groups):
+        for algorithm in algorithms:
+            with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as executor:
+                result = executor.submit(_run_case, dataset, algorithm, nb_iterations, beta, nb_restarts, repeats,
+                                         seed).result()
+            results.append(result)
+
+            if progress:
+                print(f"{result['dataset']:>14} {result['algorithm']:>20} {result['wall_time_s']:9.4f}s "
+                      f"{result['peak_rss_mb']:8.1f}MB  Q={result['modularity']:.4f}  NMI={result['nmi']:.4f}")
+
+    report = {"metadata": _metadata(parameters), "results": results}
+
+    if output is not None:
+        with open(output, "w") as file:
+            json.dump(report, file, indent=2)
+
+    return report
+
+
+def compare_reports(baseline: dict, current: dict, time_tolerance=.2, quality_tolerance=1e-3) -> list:
+    """
+    Lists the regressions of a report compared to a baseline report.
+
+    Parameters:
+        baseline (dict): The reference report (e.g. loaded with json.load).
+        current (dict): The report of the version under test.
+        time_tolerance (float): Relative wall time increase above which a run is reported. Default is 0.2.
+        quality_tolerance (float): Modularity or NMI decrease above which a run is reported. Default is 1e-3.
+
+    Returns:
+        list: One dictionary per regression with the dataset, the algorithm, the metric and both values.
+    """
+    reference = {(result["dataset"], result["algorithm"]): result for result in baseline["results"]}
+
+    regressions = []
+    for result in current["results"]:
+        previous = reference.get((result["dataset"], result["algorithm"]))
+        if previous is None:
+            continue
+
+        checks = [("wall_time_s", result["wall_time_s"] > previous["wall_time_s"] * (1 + time_tolerance)),
+                  ("modularity", result["modularity"] < previous["modularity"] - quality_tolerance),
+                  ("nmi", result["nmi"] < previous["nmi"] - quality_tolerance)]
+
+        for metric, regressed in checks:
+            if regressed:
+                regressions.append({"dataset": result["dataset"], "algorithm": result["algorithm"], "metric": metric,
+                                    "baseline": previous[metric], "current": result[metric]})
+
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark IG, MSIG and the modularity backends.")
+    parser.add_argument("--output", default="benchmark.json", help="path of the JSON report")
+    parser.add_argument("--groups", nargs="+", default=["lfr", "reel"], choices=["lfr", "reel"])
+    parser.add_argument("--algorithms", nargs="+", default=list(ALGORITHMS), choices=ALGORITHMS)
+    parser.add_argument("--iterations", type=int, default=50, help="iterations of IG and of each MSIG restart")
+    parser.add_argument("--beta", type=float, default=.4)
+    parser.add_argument("--restarts", type=int, default=4, help="number of MSIG restarts")
+    parser.add_argument("--repeats", type=int, default=20, help="timed evaluations of GCP and the modularity backends")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", help="report of a previous version, its regressions are printed")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.output, args.groups, args.algorithms, args.iterations, args.beta, args.restarts,
+                           args.repeats, args.seed)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+
+        for regression in compare_reports(baseline, report):
+            print(f"regression {regression['dataset']} {regression['algorithm']} {regression['metric']}: "
+                  f"{regression['baseline']:.4f} -> {regression['current']:.4f}")
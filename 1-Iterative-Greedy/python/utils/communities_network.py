@@ -1,33 +1,48 @@
 import numpy as np
-from itertools import combinations
+from scipy import sparse
+from scipy.sparse.linalg import LinearOperator
 from sklearn import metrics
 
 
-def modularity_matrix(adj_matrix: np.ndarray) -> np.ndarray:
+def modularity_matrix(adj_matrix: np.ndarray, resolution: float = 1.0) -> np.ndarray:
     """
     Calculates the modularity matrix for a given adjacency matrix.
 
+    The null model term is scaled by the resolution parameter gamma:
+    ( 1/2m ) * ( Aij - gamma * (ki * kj) / 2m ).
+
+    The modularity matrix is dense by nature, for a sparse adjacency matrix it is returned
+    as a linear operator that computes its products without materialising the N x N matrix.
+
     Parameters:
-        adj_matrix (np.ndarray): The adjacency matrix of the network.
+        adj_matrix (np.ndarray | scipy.sparse matrix): The adjacency matrix of the network.
+        resolution (float): The resolution parameter gamma, values above 1 favour smaller communities. Default is 1.
 
     Returns:
-        np.ndarray: The modularity matrix.
+        np.ndarray | LinearOperator: The modularity matrix.
     """
+    if sparse.issparse(adj_matrix):
+        return _sparse_modularity_matrix(adj_matrix, resolution)
+
     k_i = np.expand_dims(adj_matrix.sum(axis=1), axis=1)
     k_j = k_i.T
     norm = 1 / k_i.sum()
-    K = norm * np.matmul(k_i, k_j)
+    K = resolution * norm * np.matmul(k_i, k_j)
 
     return norm * (adj_matrix - K)
 
 
-def modularity(adj_matrix: np.ndarray, communities: list) -> float:
+def modularity(adj_matrix: np.ndarray, communities: list, resolution: float = 1.0) -> float:
     """
     Calculates the modularity of a network given the adjacency matrix and a list of communities.
 
+    The communities are converted into a vector of labels and the modularity is computed from
+    the edge list (see `labels_modularity`), so memory scales with the number of edges instead of N^2.
+
     Parameters:
-        adj_matrix (np.ndarray): The adjacency matrix of the network.
+        adj_matrix (np.ndarray | scipy.sparse matrix): The adjacency matrix of the network.
         communities (list): A list of communities, where each community is represented as a list of node indices.
+        resolution (float): The resolution parameter gamma. Default is 1.
 
     Returns:
         float: The modularity value of the network.
@@ -36,50 +51,184 @@ def modularity(adj_matrix: np.ndarray, communities: list) -> float:
         None
 
     """
-    k_i = np.expand_dims(adj_matrix.sum(axis=1), axis=1)
-    k_j = k_i.T
+    labels = communities_to_label_vector(adj_matrix.shape[0], communities)
+
+    return labels_modularity(adj_matrix, labels, resolution=resolution)
+
+
+def filter_adj_matrix(adj_matrix: np.ndarray, V: list) -> np.ndarray:
+    """
+    Filters the adjacency matrix by keeping only the nodes in V.
+
+    This materialises a new matrix, use `subgraph_modularity` when only the modularity
+    of the induced subgraph is needed.
+
+    Parameters:
+        adj_matrix (np.ndarray | scipy.sparse matrix): The adjacency matrix representing the network.
+        V (list): The list of nodes to keep in the filtered adjacency matrix.
+
+    Returns:
+        np.ndarray | scipy.sparse.csr_matrix: The filtered adjacency matrix.
+    """
+    keep = np.zeros(adj_matrix.shape[0], dtype=bool)
+    keep[np.asarray(V, dtype=np.int64)] = True
+
+    if sparse.issparse(adj_matrix):
+        keep = sparse.diags(keep.astype(np.float64))
+
+        new_adj_matrix = sparse.csr_matrix(keep @ adj_matrix @ keep)
+        new_adj_matrix.eliminate_zeros()
+
+        return new_adj_matrix
+
+    new_adj_matrix = adj_matrix.copy()
+    new_adj_matrix[~keep, :] = 0
+    new_adj_matrix[:, ~keep] = 0
+
+    return new_adj_matrix
+
+
+def subgraph_modularity(adj_matrix, communities: list, mask: np.ndarray, resolution: float = 1.0) -> float:
+    """
+    Calculates the modularity of the subgraph induced by the active nodes of mask.
+
+    The result is the same as `modularity(filter_adj_matrix(adj_matrix, V), communities)` with V the
+    active nodes, but the edges leaving the subgraph are masked out on the fly instead of copying
+    and zeroing the adjacency matrix.
+
+    Parameters:
+        adj_matrix (np.ndarray | scipy.sparse matrix): The adjacency matrix of the network.
+        communities (list): A list of communities, where each community is represented as a list of node indices.
+        mask (np.ndarray): A boolean vector, True for the nodes of the subgraph.
+        resolution (float): The resolution parameter gamma. Default is 1.
+
+    Returns:
+        float: The modularity value of the subgraph.
+    """
+    labels = communities_to_label_vector(adj_matrix.shape[0], communities)
+
+    return labels_modularity(adj_matrix, labels, mask, resolution)
+
+
+def communities_to_label_vector(n: int, communities: list) -> np.ndarray:
+    """
+    Converts a list of communities into a vector giving the community index of every node.
+
+    Parameters:
+        n (int): The number of nodes in the network.
+        communities (list): A list of communities, where each community is represented as a list of node indices.
+
+    Returns:
+        np.ndarray: The community index of each node, -1 for the nodes that aren't in any community.
+    """
+    labels = np.full(n, -1, dtype=np.int64)
+
+    for index, community in enumerate(communities):
+        labels[np.asarray(community, dtype=np.int64)] = index
+
+    return labels
+
+
+def label_vector_to_communities(labels: np.ndarray) -> list:
+    """
+    Converts a vector giving the community index of every node into a list of communities.
+
+    Parameters:
+        labels (np.ndarray): The community index of each node, -1 for the nodes that aren't in any community.
+
+    Returns:
+        list: A list of communities, where each community is represented as a list of node indices.
+    """
+    labels = np.asarray(labels)
+
+    nodes = np.flatnonzero(labels >= 0)
+    nodes = nodes[np.argsort(labels[nodes], kind="stable")]
+    boundaries = np.flatnonzero(np.diff(labels[nodes])) + 1
+
+    return [community.tolist() for community in np.split(nodes, boundaries) if len(community)]
 
-    weights_sum = k_i.sum()
+
+def labels_modularity(adj_matrix, labels: np.ndarray, mask: np.ndarray = None, resolution: float = 1.0,
+                      degrees: np.ndarray = None) -> float:
+    """
+    Calculates the modularity of a network from its edge list and the community label of each node.
+
+    The internal weight and the total degree of every community are obtained with a single
+    `np.bincount` pass over the edges and the nodes. The value is the sum of the modularity
+    matrix over the pairs of distinct nodes sharing a community, like `modularity`.
+
+    The edge weights are used as they are, and the expected weight ki * kj / 2m of the null model
+    is scaled by the resolution gamma. A sweep over several resolutions can pass the degree vector
+    computed once with `degrees` instead of recomputing it from the edges at every call.
+
+    Parameters:
+        adj_matrix (np.ndarray | scipy.sparse matrix): The adjacency matrix of the network.
+        labels (np.ndarray): The community index of each node, -1 for the nodes that aren't in any community.
+        mask (np.ndarray): A boolean vector, when given only the subgraph induced by its True nodes is considered.
+        resolution (float): The resolution parameter gamma. Default is 1.
+        degrees (np.ndarray): The weighted degree of each node, ignored when mask is given. Default is None.
+
+    Returns:
+        float: The modularity value of the network.
+    """
+    edges = sparse.coo_matrix(adj_matrix)
+    rows, cols, weights = edges.row, edges.col, edges.data
+    labels = np.asarray(labels)
+
+    if mask is not None:
+        # drop the edges leaving the subgraph and the labels of the nodes outside it
+        inside = mask[rows] & mask[cols]
+        rows, cols, weights = rows[inside], cols[inside], weights[inside]
+        labels = np.where(mask, labels, -1)
+
+    if degrees is None or mask is not None:
+        k = np.bincount(rows, weights=weights, minlength=adj_matrix.shape[0])
+    else:
+        k = np.asarray(degrees, dtype=np.float64)
+
+    weights_sum = k.sum()
 
     # if the nodes aren't linked we return the worst modularity
     if weights_sum == 0:
         return -1
 
-    norm = 1 / weights_sum
-    K = norm * np.matmul(k_i, k_j)  # (ki * kj) / 2m
-    mod_matrix = norm * (adj_matrix - K)  # ( 1/2m ) *  Aij - (ki * kj) / 2m
+    assigned = labels >= 0
+    nb_communities = labels.max() + 1 if assigned.any() else 0
 
-    C = np.zeros_like(mod_matrix)
+    rows_labels = labels[rows]
+    internal = (rows_labels == labels[cols]) & (
+        rows_labels >= 0) & (rows != cols)
 
-    for community in communities:
-        if len(community) <= 1:
-            continue
-        for i, j in combinations(community, 2):
-            C[i, j] = 1.0
-            C[j, i] = 1.0
+    internal_weights = np.bincount(
+        rows_labels[internal], weights=weights[internal], minlength=nb_communities)
+    degree_sums = np.bincount(
+        labels[assigned], weights=k[assigned], minlength=nb_communities)
 
-    return np.tril(np.multiply(mod_matrix, C), 0).sum()
+    # sum of ki * kj over the pairs of distinct nodes of the same community
+    expected = np.square(degree_sums).sum() - np.square(k[assigned]).sum()
 
+    return 0.5 * (internal_weights.sum() / weights_sum - resolution * expected / weights_sum ** 2)
 
-def filter_adj_matrix(adj_matrix: np.ndarray, V: list) -> np.ndarray:
+
+def _sparse_modularity_matrix(adj_matrix, resolution: float = 1.0) -> LinearOperator:
     """
-    Filters the adjacency matrix by keeping only the nodes in V.
+    Builds the modularity matrix of a sparse network as a linear operator.
 
     Parameters:
-        adj_matrix (np.ndarray): The adjacency matrix representing the network.
-        V (list): The list of nodes to keep in the filtered adjacency matrix.
+        adj_matrix (scipy.sparse matrix): The adjacency matrix of the network.
+        resolution (float): The resolution parameter gamma. Default is 1.
 
     Returns:
-        np.ndarray: The filtered adjacency matrix.
+        LinearOperator: The (symmetric) modularity matrix ( 1/2m ) * ( Aij - gamma * (ki * kj) / 2m ).
     """
-    new_adj_matrix = adj_matrix.copy()
+    k = np.asarray(adj_matrix.sum(axis=1)).ravel()
+    norm = 1 / k.sum()
 
-    for i in range(new_adj_matrix.shape[0]):
-        if i not in V:
-            new_adj_matrix[i, :] = 0
-            new_adj_matrix[:, i] = 0
+    def product(x):
+        return norm * (adj_matrix @ x - resolution * norm * np.multiply.outer(k, k @ x))
 
-    return new_adj_matrix
+    return LinearOperator(adj_matrix.shape, matvec=product, rmatvec=product,
+                          matmat=product, dtype=np.float64)
 
 
 def communities_to_labels(G, communities: list) -> list:
@@ -0,0 +1,338 @@
+import numpy as np
+from scipy import sparse
+from utils.modularity_engine import ModularityEngine
+from utils.iterative_greedy_algorithm import IG, initial_labels, reconstruct
+from utils.communities_network import label_vector_to_communities
+
+
+class DynamicModularityEngine(ModularityEngine):
+    """
+    `ModularityEngine` on a graph whose edges change over time.
+
+    The adjacency stays in the CSR arrays of the engine, with a few free slots in every row.
+    A free slot points to its own row with a null weight, so it is skipped like a self-loop
+    by the NumPy code and by the kernels of `ig_kernels`. Inserting or deleting an edge
+    rewrites one slot in each of its two rows (the arrays are only repacked when a row is
+    full), and the degree, community and total weight aggregates are updated in place
+    instead of being rebuilt from the CSR structure.
+    """
+
+    def __init__(self, adj_matrix, resolution: float = 1.0):
+        super().__init__(adj_matrix, resolution)
+
+        self._repack(self.n)
+
+    def _repack(self, n: int):
+        """
+        Rebuilds the CSR arrays for n nodes, every row gets max(2, deg / 4) free slots.
+
+        Parameters:
+            n (int): The number of nodes, at least the current one.
+        """
+        used = (self.indices != self.rows) | (self.data != 0)
+        used_rows = self.rows[used]
+
+        counts = np.bincount(used_rows, minlength=n)
+        capacities = counts + np.maximum(counts // 4, 2)
+
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(capacities, out=indptr[1:])
+
+        # the used slots keep their order, at the start of their row
+        firsts = np.cumsum(counts) - counts
+        positions = indptr[used_rows] + np.arange(len(used_rows)) - firsts[used_rows]
+
+        rows = np.repeat(np.arange(n), capacities)
+        indices = rows.copy()
+        data = np.zeros(len(rows))
+        indices[positions] = self.indices[used]
+        data[positions] = self.data[used]
+
+        self.indptr, self.indices, self.data, self.rows = indptr, indices, data, rows
+
+    def _slot(self, u: int, v: int) -> int:
+        """
+        Returns the position of the edge (u, v) in the row of u, -1 if there is no such edge.
+        """
+        start, end = self.indptr[u], self.indptr[u + 1]
+        found = self.indices[start:end] == v
+        if u == v:
+            found &= self.data[start:end] != 0
+
+        positions = np.flatnonzero(found)
+
+        return start + positions[0] if len(positions) else -1
+
+    def _free_slot(self, u: int) -> int:
+        """
+        Returns the position of a free slot in the row of u, the arrays are repacked if the row is full.
+        """
+        start, end = self.indptr[u], self.indptr[u + 1]
+        positions = np.flatnonzero((self.indices[start:end] == u) & (self.data[start:end] == 0))
+
+        if not len(positions):
+            self._repack(self.n)
+            return self._free_slot(u)
+
+        return start + positions[0]
+
+    def _add_weight(self, u: int, v: int, weight: float):
+        """
+        Adds weight to the slot of the edge (u, v) in the row of u, the slot is freed when the weight drops to 0.
+        """
+        position = self._slot(u, v)
+        if position < 0:
+            position = self._free_slot(u)
+
+        new_weight = self.data[position] + weight
+        if np.isclose(new_weight, 0):
+            self.indices[position], self.data[position] = u, 0.0
+        else:
+            self.indices[position], self.data[position] = v, new_weight
+
+    def add_nodes(self, n: int):
+        """
+        Grows the graph to n nodes, the new nodes are isolated and removed (label -1).
+
+        Parameters:
+            n (int): The new number of nodes.
+        """
+        if n <= self.n:
+            return
+
+        extra = n - self.n
+
+        self.labels = np.concatenate([self.labels, np.full(extra, -1)])
+        self.active = np.concatenate([self.active, np.zeros(extra, dtype=bool)])
+        self.k = np.concatenate([self.k, np.zeros(extra)])
+        self.degrees = np.concatenate([self.degrees, np.zeros(extra)])
+        self.self_loops = np.concatenate([self.self_loops, np.zeros(extra)])
+        self.sizes = np.concatenate([self.sizes, np.zeros(extra, dtype=self.sizes.dtype)])
+        self.degree_sums = np.concatenate([self.degree_sums, np.zeros(extra)])
+        self.internal_weights = np.concatenate([self.internal_weights, np.zeros(extra)])
+        self._repack(n)
+
+        self.n = n
+
+    def update_edge(self, u: int, v: int, weight: float):
+        """
+        Adds weight to the edge (u, v), a negative weight removes it (partially).
+
+        When both nodes are active, the degrees of u and v, the total degree and internal
+        weight of their communities, and the total weight are updated in O(1).
+
+        Parameters:
+            u (int): First end of the edge.
+            v (int): Second end of the edge.
+            weight (float): The weight added to the edge.
+        """
+        if min(u, v) < 0:
+            raise ValueError(f"Invalid edge ({u}, {v}), node indices must be non-negative")
+
+        self.add_nodes(max(u, v) + 1)
+
+        self.degrees[u] += weight
+        self._add_weight(u, v, weight)
+        if u == v:
+            self.self_loops[u] += weight
+        else:
+            self.degrees[v] += weight
+            self._add_weight(v, u, weight)
+
+        if not (self.active[u] and self.active[v]):
+            return
+
+        ends = [u] if u == v else [u, v]
+        added = weight if u == v else 2 * weight
+
+        for node in ends:
+            self.sum_k2 += (self.k[node] + weight) ** 2 - self.k[node] ** 2
+            self.k[node] += weight
+            self.degree_sums[self.labels[node]] += weight
+
+        self.two_m += added
+        if u == v:
+            self.trace += weight
+        if self.labels[u] == self.labels[v]:
+            self.internal_weights[self.labels[u]] += added
+
+    def edge_weight(self, u: int, v: int) -> float:
+        """
+        Returns the weight of the edge (u, v), 0 if a node is not in the graph yet.
+        """
+        if min(u, v) < 0:
+            raise ValueError(f"Invalid edge ({u}, {v}), node indices must be non-negative")
+        if max(u, v) >= self.n:
+            return 0.0
+
+        position = self._slot(u, v)
+
+        return self.data[position] if position >= 0 else 0.0
+
+    def to_csr(self) -> sparse.csr_matrix:
+        """
+        Builds the current adjacency matrix.
+
+        Returns:
+            scipy.sparse.csr_matrix: The adjacency matrix of the graph.
+        """
+        csr = sparse.csr_matrix((self.data, self.indices, self.indptr), shape=(self.n, self.n), copy=True)
+        csr.eliminate_zeros()
+
+        return csr
+
+    def resync(self):
+        """
+        Repacks the CSR arrays and recomputes every aggregate from scratch, which removes
+        the rounding errors accumulated by the incremental updates.
+        """
+        self._repack(self.n)
+
+        loops = self.indices == self.rows
+        self.self_loops = np.bincount(self.rows[loops], weights=self.data[loops], minlength=self.n)
+        self.degrees = np.bincount(self.rows, weights=self.data, minlength=self.n).astype(np.float64)
+
+        self.reset(self.labels)
+
+
+class DynamicCommunities:
+    """
+    Community detection service for a graph receiving batches of edge insertions and deletions.
+
+    Each batch updates the graph and the modularity aggregates incrementally, then runs a
+    few destroy/reconstruct iterations of IG restricted to the neighbourhood of the changed
+    edges (their ends and the neighbours of the ends), each followed by a local search seeded
+    with the nodes that changed community. A perturbed solution is only kept if it improves
+    the modularity, otherwise the engine goes back to the previous one, and the batch stops
+    after `patience` iterations in a row without improvement. The cost of a batch depends on
+    the size of that neighbourhood, not on the whole graph.
+    """
+
+    def __init__(self, adj_matrix, initial=None, nb_iterations=10, beta=.4, local_search=True,
+                 resync_every=100, seed=None, resolution=1.0, patience=2, **ig_kwargs):
+        """
+        Parameters:
+            adj_matrix (np.ndarray | scipy.sparse matrix): The adjacency matrix of the initial graph.
+            initial (Partition | dict | list | np.ndarray): Initial solution (see `initial_labels`), computed with
+                                                            `IG` when not given. Default is None.
+            nb_iterations (int): Maximum number of destroy/reconstruct iterations per batch. Default is 10.
+            beta (float): Fraction of the neighbourhood destroyed at each iteration. Default is 0.4.
+            local_search (bool): Whether each reconstruction is followed by a local search. Default is True.
+            resync_every (int): The aggregates are recomputed from scratch every resync_every batches. Default is 100.
+            seed (int | np.random.Generator): Seed of the service. Default is None.
+            resolution (float): The resolution parameter gamma of the modularity. Default is 1.
+            patience (int): A batch stops after this many consecutive iterations without improvement,
+                            None to always run nb_iterations iterations. Default is 2.
+            ig_kwargs: Arguments of the `IG` run computing the initial solution.
+        """
+        self.rng = np.random.default_rng(seed)
+        self.nb_iterations = nb_iterations
+        self.beta = beta
+        self.local_search = local_search
+        self.resync_every = resync_every
+        self.patience = patience
+        self.nb_batches = 0
+
+        if initial is None:
+            ig_kwargs = {"progress": False, "record": "none", **ig_kwargs}
+            initial, _, _, _ = IG(adj_matrix, seed=self.rng,
+                                  resolution=resolution, **ig_kwargs)
+
+        labels = initial_labels(adj_matrix, initial)
+
+        self.engine = DynamicModularityEngine(adj_matrix, resolution)
+        reconstruct(adj_matrix, labels, self.rng.permutation(
+            np.flatnonzero(labels < 0)), self.engine, resolution)
+
+    @property
+    def labels(self) -> np.ndarray:
+        return self.engine.labels.copy()
+
+    def communities(self) -> list:
+        return label_vector_to_communities(self.engine.labels)
+
+    def modularity(self) -> float:
+        return self.engine.modularity()
+
+    def _neighbourhood(self, nodes: np.ndarray) -> np.ndarray:
+        engine = self.engine
+        rows = [engine.indices[engine.indptr[node]:engine.indptr[node + 1]] for node in nodes]
+
+        # the free slots point to their own row, which is already in nodes
+        return np.unique(np.concatenate([nodes] + rows))
+
+    def update(self, inserted=(), deleted=()) -> tuple:
+        """
+        Applies a batch of edge updates and refreshes the communities around them.
+
+        Parameters:
+            inserted (list): The inserted edges, as (u, v) or (u, v, weight) tuples.
+            deleted (list): The deleted edges, as (u, v) tuples, the whole edge is removed. Edges that are
+                            not in the graph are ignored.
+
+        Returns:
+            tuple: The nodes whose community changed and their new community index.
+        """
+        engine = self.engine
+        before = engine.labels.copy()
+
+        touched = set()
+        for edge in inserted:
+            u, v = edge[0], edge[1]
+            engine.update_edge(u, v, edge[2] if len(edge) > 2 else 1.0)
+            touched.update((u, v))
+        for u, v in deleted:
+            weight = engine.edge_weight(u, v)
+            # deleting a missing edge (e.g. towards a node never seen) is a no-op
+            if weight == 0:
+                continue
+            engine.update_edge(u, v, -weight)
+            touched.update((u, v))
+
+        if len(before) < engine.n:
+            before = np.concatenate([before, np.full(engine.n - len(before), -1)])
+
+        if not touched:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+        # new nodes join the solution greedily
+        engine.insert_nodes(self.rng.permutation(np.flatnonzero(~engine.active)))
+
+        touched = np.fromiter(touched, dtype=np.int64)
+        neighbourhood = self._neighbourhood(touched)
+
+        if self.local_search:
+            engine.local_search(self.rng.permutation(touched))
+        best_mod = engine.modularity()
+
+        stalled = 0
+        for _ in range(self.nb_iterations):
+            snapshot = engine.snapshot()
+
+            size = max(1, int(self.beta * len(neighbourhood)))
+            removed = self.rng.choice(neighbourhood, size, replace=False)
+
+            engine.remove_nodes(removed)
+            engine.insert_nodes(removed)
+
+            # the nodes that changed community seed the local search, their moves queue their neighbours
+            if self.local_search:
+                engine.local_search(np.flatnonzero(engine.labels != snapshot[0]))
+
+            mod = engine.modularity()
+            if mod > best_mod:
+                best_mod = mod
+                stalled = 0
+            else:
+                engine.restore(snapshot)
+                stalled += 1
+                if self.patience and stalled >= self.patience:
+                    break
+
+        self.nb_batches += 1
+        if self.resync_every and self.nb_batches % self.resync_every == 0:
+            engine.resync()
+
+        changed = np.flatnonzero(engine.labels != before)
+
+        return changed, engine.labels[changed]
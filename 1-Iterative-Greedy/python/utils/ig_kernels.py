@@ -0,0 +1,217 @@
+"""
+Compiled kernels for the hot loops of IG (GCP, destruction and reconstruction).
+
+The kernels work directly on the CSR arrays and the aggregates of `ModularityEngine`.
+They are compiled with Numba when it is installed; otherwise `NUMBA_AVAILABLE` is False
+and `insert_nodes` / `remove_nodes` fall back to `ModularityEngine.insert` / `ModularityEngine.remove`,
+the NumPy implementation.
+Both paths score the communities with the same formula and break ties the same way
+(highest gain, then smallest community index), so they build the same partitions for a
+fixed seed.
+"""
+import numpy as np
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda function: function
+
+
+@njit(cache=True)
+def new_label(sizes: np.ndarray, next_label: int, n: int) -> tuple:
+    """
+    Returns an unused community index and the next fresh index, see `ModularityEngine._new_label`.
+    """
+    if next_label < n:
+        return next_label, next_label + 1
+
+    for label in range(n):
+        if sizes[label] == 0:
+            return label, next_label
+
+    return -1, next_label
+
+
+@njit(cache=True)
+def best_community(candidates: np.ndarray, links: np.ndarray, nb_candidates: int, degree_sums: np.ndarray,
+                   k_v: float, two_m: float, resolution: float, allow_ties: bool) -> tuple:
+    """
+    Scores the candidate communities of a node with the delta-modularity
+        w(v, c) / 2m - gamma * k_v * K_c / (2m)^2
+    and returns the best community (-1 if no community beats a new one) with its links.
+    """
+    best = -1
+    best_gain = 0.0
+    best_links = 0.0
+
+    for i in range(nb_candidates):
+        community = candidates[i]
+        gain = links[community] / two_m - resolution * k_v * \
+            degree_sums[community] / two_m ** 2
+
+        if best < 0 or gain > best_gain or (gain == best_gain and community < best):
+            best = community
+            best_gain = gain
+            best_links = links[community]
+
+    if best >= 0 and (best_gain > 0 or (allow_ties and best_gain == 0)):
+        return best, best_links
+
+    return -1, 0.0
+
+
+@njit(cache=True)
+def insert_nodes_kernel(indptr, indices, data, self_loops, labels, active, k, sizes, degree_sums,
+                        internal_weights, nodes, allow_ties, resolution, two_m, sum_k2, trace, next_label):
+    """
+    Inserts the nodes one after the other in their best community, see `ModularityEngine.insert`.
+
+    The arrays are updated in place, the scalar aggregates are returned as
+    (two_m, sum_k2, trace, next_label).
+    """
+    n = len(labels)
+
+    # scratch buffers: links towards each community, reset after each node
+    links = np.zeros(n)
+    seen = np.zeros(n, dtype=np.bool_)
+    candidates = np.empty(n, dtype=np.int64)
+
+    for node in nodes:
+        added = 0.0
+        nb_candidates = 0
+
+        # the node joins the active subgraph: its neighbours' degrees grow
+        for position in range(indptr[node], indptr[node + 1]):
+            neighbour = indices[position]
+            if neighbour == node or not active[neighbour]:
+                continue
+
+            weight = data[position]
+            community = labels[neighbour]
+
+            added += weight
+            sum_k2 += (k[neighbour] + weight) ** 2 - k[neighbour] ** 2
+            k[neighbour] += weight
+            degree_sums[community] += weight
+
+            if not seen[community]:
+                seen[community] = True
+                candidates[nb_candidates] = community
+                nb_candidates += 1
+            links[community] += weight
+
+        k_v = added + self_loops[node]
+        two_m += 2 * added + self_loops[node]
+
+        community, community_links = -1, 0.0
+        if nb_candidates and two_m > 0:
+            community, community_links = best_community(
+                candidates, links, nb_candidates, degree_sums, k_v, two_m, resolution, allow_ties)
+
+        for i in range(nb_candidates):
+            links[candidates[i]] = 0.0
+            seen[candidates[i]] = False
+
+        if community < 0:
+            community, next_label = new_label(sizes, next_label, n)
+
+        labels[node] = community
+        active[node] = True
+        k[node] = k_v
+        sum_k2 += k_v ** 2
+        trace += self_loops[node]
+
+        sizes[community] += 1
+        degree_sums[community] += k_v
+        internal_weights[community] += 2 * community_links + self_loops[node]
+
+    return two_m, sum_k2, trace, next_label
+
+
+@njit(cache=True)
+def remove_nodes_kernel(indptr, indices, data, self_loops, labels, active, k, sizes, degree_sums,
+                        internal_weights, nodes, two_m, sum_k2, trace):
+    """
+    Removes the nodes one after the other from their community, see `ModularityEngine.remove`.
+
+    The arrays are updated in place, the scalar aggregates are returned as (two_m, sum_k2, trace).
+    """
+    for node in nodes:
+        community = labels[node]
+        k_v = k[node]
+        removed = 0.0
+        links = 0.0
+
+        # the node leaves the active subgraph: its neighbours' degrees shrink
+        for position in range(indptr[node], indptr[node + 1]):
+            neighbour = indices[position]
+            if neighbour == node or not active[neighbour]:
+                continue
+
+            weight = data[position]
+            if labels[neighbour] == community:
+                links += weight
+
+            removed += weight
+            sum_k2 += (k[neighbour] - weight) ** 2 - k[neighbour] ** 2
+            k[neighbour] -= weight
+            degree_sums[labels[neighbour]] -= weight
+
+        sizes[community] -= 1
+        degree_sums[community] -= k_v
+        internal_weights[community] -= 2 * links + self_loops[node]
+
+        labels[node] = -1
+        active[node] = False
+        k[node] = 0.0
+        sum_k2 -= k_v ** 2
+        trace -= self_loops[node]
+        two_m -= 2 * removed + self_loops[node]
+
+    return two_m, sum_k2, trace
+
+
+def insert_nodes(engine, nodes, allow_ties=True):
+    """
+    Inserts removed nodes one after the other in the community that maximizes the modularity.
+
+    Parameters:
+        engine (ModularityEngine): The engine holding the partial solution.
+        nodes (list): The nodes to insert, in insertion order.
+        allow_ties (bool): Whether a node joins the best community when the gain is exactly zero.
+    """
+    if not (NUMBA_AVAILABLE and engine.use_kernels):
+        for node in nodes:
+            engine.insert(node, allow_ties=allow_ties)
+        return
+
+    engine.two_m, engine.sum_k2, engine.trace, engine.next_label = insert_nodes_kernel(
+        engine.indptr, engine.indices, engine.data, engine.self_loops, engine.labels, engine.active,
+        engine.k, engine.sizes, engine.degree_sums, engine.internal_weights,
+        np.asarray(nodes, dtype=np.int64), allow_ties, float(engine.resolution),
+        float(engine.two_m), float(engine.sum_k2), float(engine.trace), int(engine.next_label))
+
+
+def remove_nodes(engine, nodes):
+    """
+    Removes active nodes one after the other from their community and from the active subgraph.
+
+    Parameters:
+        engine (ModularityEngine): The engine holding the partial solution.
+        nodes (list): The nodes to remove.
+    """
+    if not (NUMBA_AVAILABLE and engine.use_kernels):
+        for node in nodes:
+            engine.remove(node)
+        return
+
+    engine.two_m, engine.sum_k2, engine.trace = remove_nodes_kernel(
+        engine.indptr, engine.indices, engine.data, engine.self_loops, engine.labels, engine.active,
+        engine.k, engine.sizes, engine.degree_sums, engine.internal_weights,
+        np.asarray(nodes, dtype=np.int64), float(engine.two_m), float(engine.sum_k2), float(engine.trace))
@@ -1,10 +1,17 @@
+import time
 import numpy as np
-from utils.communities_network import modularity_matrix, modularity, filter_adj_matrix
+from collections import deque
+from itertools import count
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from utils.communities_network import labels_modularity, communities_to_label_vector, label_vector_to_communities
 from utils.visualization_animation import communities_to_frame
+from utils.modularity_engine import ModularityEngine
+from utils.partition import Partition
+from utils.shared_graph import SharedGraph, attach_worker, worker_graph
 from tqdm.notebook import tqdm
 
 
-def GCP(adj_matrix: np.ndarray) -> list:
+def GCP(adj_matrix: np.ndarray, seed=None, engine: ModularityEngine = None, resolution: float = 1.0) -> list:
     """
     Greedy Constructive Procedure (GCP) for generating an initial solution for the iterative greedy metaheuristic.
 
@@ -12,69 +19,34 @@ def GCP(adj_matrix: np.ndarray) -> list:
     follows a traditional greedy approach, where each node is added to the best cluster according to
     a greedy function value. Additionally, the method is randomized in order to increase the diversity of the solutions generated.
 
+    The nodes are inserted in a random order, and the modularity gains of all the candidate
+    communities of a node are computed at once from the histogram of its neighbours' labels
+    (see `ModularityEngine.insert`), on the subgraph induced by the nodes inserted so far.
+
     Args:
         adj_matrix (np.ndarray): Adjacency matrix representing the graph.
+        seed (int | np.random.Generator): Seed or generator of the random insertion order. Default is None.
+        engine (ModularityEngine): The engine built on adj_matrix, it is created if not given.
+        resolution (float): The resolution parameter gamma of the modularity. Default is 1.
 
     Returns:
         tuple: A tuple containing the communities (clusters) generated by GCP and the modularity value of the solution.
     """
+    rng = np.random.default_rng(seed)
 
-    V = list(range(adj_matrix.shape[0]))
-
-    v = np.random.choice(V)
-    V.remove(v)
-
-    K0 = [v]
-    communities = [K0]
-    nodes = [v]
-
-    Mdb = -1
-
-    while V:
-        v = np.random.choice(V)
-        nodes.append(v)
-
-        Mdb = -1
-        best_community = None
-        best_community_index = -1
-
-        new_adj_matrix = filter_adj_matrix(
-            adj_matrix, nodes)
-
-        for i, Ki in enumerate(communities):
-            Ki_new = Ki + [v]
-
-            new_communities = communities.copy()
+    if engine is None:
+        engine = ModularityEngine(adj_matrix)
 
-            new_communities[i] = Ki_new
+    engine.resolution = resolution
+    engine.reset()
 
-            Md = modularity(new_adj_matrix, new_communities)
+    # a node only joins a community if it strictly improves the modularity
+    engine.insert_nodes(rng.permutation(adj_matrix.shape[0]), allow_ties=False)
 
-            if Md > Mdb:
-                Mdb = Md
-                best_community = Ki_new
-                best_community_index = i
+    return label_vector_to_communities(engine.labels), engine.modularity()
 
-        if len(nodes) > 1:
-            new_adj_matrix = filter_adj_matrix(adj_matrix, nodes)
-            Mdphi = modularity(new_adj_matrix, communities + [[v]])
-        else:
-            Mdphi = -1
-
-        if Mdb > Mdphi:
-            communities[best_community_index] = best_community
-        else:
-
-            Mdb = Mdphi
-            Ki = [v]
-            communities.append(Ki)
-
-        V.remove(v)
 
-    return communities, Mdb
-
-
-def destruct(adj_matrix: np.ndarray, communities: list, beta: float) -> tuple:
+def destruct(adj_matrix: np.ndarray, labels: np.ndarray, beta: float, seed=None) -> tuple:
     """
     The destruction phase of the IG algorithm starts from a feasible
     solution generated with the constructive method described in Section.
@@ -84,126 +56,396 @@ def destruct(adj_matrix: np.ndarray, communities: list, beta: float) -> tuple:
     their corresponding clusters, which will be later reassigned in the
     reconstruction phase.
 
+    The solution is handled as a vector of labels, so removing the nodes is a
+    single O(n) masking operation.
+
     Parameters:
     adj_matrix (np.ndarray): The adjacency matrix of the graph.
-    communities (list): The list of communities in the current solution.
+    labels (np.ndarray): The community index of each node in the current solution.
     beta (float): The parameter that controls the perturbation size.
+    seed (int | np.random.Generator): Seed or generator used to draw the removed nodes.
 
     Returns:
-    tuple: A tuple containing the removed nodes and the filtered communities.
+    tuple: A tuple containing the removed nodes (in their reinsertion order), the boolean removal mask
+           and the labels of the destructed solution (-1 for the removed nodes).
     """
-    nodes = list(range(adj_matrix.shape[0]))
-
-    removed_nodes = np.random.choice(
-        nodes, int(beta * len(nodes)), replace=False)
+    rng = np.random.default_rng(seed)
+    n = adj_matrix.shape[0]
 
-    filtered_communities = []
-    for community in communities:
+    removed_nodes = rng.choice(n, int(beta * n), replace=False)
 
-        new_community = [
-            node for node in community if node not in removed_nodes]
+    removed_mask = np.zeros(n, dtype=bool)
+    removed_mask[removed_nodes] = True
 
-        if new_community:
-            filtered_communities.append(new_community)
+    filtered_labels = np.where(removed_mask, -1, labels)
 
-    return removed_nodes, filtered_communities
+    return removed_nodes, removed_mask, filtered_labels
 
 
-def reconstruct(adj_matrix: np.ndarray, communities: list, removed_nodes: list) -> tuple:
+def reconstruct(adj_matrix: np.ndarray, labels: np.ndarray, removed_nodes: list, engine: ModularityEngine = None,
+                resolution: float = 1.0) -> tuple:
     """
     Reconstructs the communities after removing nodes from the adjacency matrix.
     Each node is assigned to the community that maximizes the modularity.
 
+    The candidate communities are scored with the incremental delta-modularity of
+    `ModularityEngine`, so inserting a node costs O(deg(v)) instead of a full
+    modularity computation per community.
+
     Args:
         adj_matrix (np.ndarray): The adjacency matrix representing the graph.
-        communities (list): The list of communities.
+        labels (np.ndarray): The community index of each node, -1 for the removed nodes.
         removed_nodes (list): The list of nodes that have been removed.
+        engine (ModularityEngine): The engine built on adj_matrix, it is created if not given.
+        resolution (float): The resolution parameter gamma of the modularity. Default is 1.
+
+    Returns:
+        tuple: A tuple containing the labels of the reconstructed solution and the modularity score.
+    """
+    if engine is None:
+        engine = ModularityEngine(adj_matrix)
+
+    engine.resolution = resolution
+    engine.reset(labels)
+    engine.insert_nodes(removed_nodes)
+
+    return engine.labels.copy(), engine.modularity()
+
+
+def refine(adj_matrix: np.ndarray, labels: np.ndarray, engine: ModularityEngine = None, seed=None,
+           resolution: float = 1.0) -> tuple:
+    """
+    Local improvement phase applied after the reconstruction.
+
+    Nodes are moved one at a time to the community that maximizes the modularity
+    (Louvain-style vertex mover), until no improving move remains.
+
+    Args:
+        adj_matrix (np.ndarray): The adjacency matrix representing the graph.
+        labels (np.ndarray): The community index of each node.
+        engine (ModularityEngine): The engine built on adj_matrix, it is created if not given.
+        seed (int | np.random.Generator): Seed or generator of the order in which the nodes are visited.
+        resolution (float): The resolution parameter gamma of the modularity. Default is 1.
 
     Returns:
-        tuple: A tuple containing the reconstructed communities and the modularity score.
+        tuple: A tuple containing the labels of the refined solution and the modularity score.
     """
-    nodes = [node for node in list(
-        range(adj_matrix.shape[0])) if node not in removed_nodes]
+    if engine is None:
+        engine = ModularityEngine(adj_matrix)
 
-    Mdb = -1
+    rng = np.random.default_rng(seed)
 
-    for node in removed_nodes:
-        Mdb = -1
-        best_community = None
-        best_community_index = -1
+    engine.resolution = resolution
+    engine.reset(labels)
+    engine.local_search(rng.permutation(adj_matrix.shape[0]))
 
-        nodes.append(node)
+    return engine.labels.copy(), engine.modularity()
 
-        new_adj_matrix = filter_adj_matrix(adj_matrix, nodes)
 
-        for i, Ki in enumerate(communities):
+def initial_labels(adj_matrix: np.ndarray, initial) -> np.ndarray:
+    """
+    Converts an existing solution into the label vector IG starts from.
 
-            Ki_new = Ki + [node]
+    Parameters:
+        adj_matrix (np.ndarray): The adjacency matrix representing the graph.
+        initial (Partition | dict | list | np.ndarray): The solution, either a `Partition`, a dictionary mapping
+            each node index to its community (e.g. `louvain`, see `Partition.from_dict` for graphs whose nodes
+            aren't indices), a list of communities (e.g. the result of a previous `IG` run) or a vector of
+            labels (e.g. `kmeans_clustering`). Nodes without a community can be labelled -1 or left out.
 
-            new_communities = communities.copy()
-            new_communities[i] = Ki_new
+    Returns:
+        np.ndarray: The community index of each node, numbered from 0, -1 for the nodes without a community.
+    """
+    n = adj_matrix.shape[0]
 
-            Md = modularity(new_adj_matrix, new_communities)
+    if isinstance(initial, Partition):
+        labels = initial.labels.astype(np.int64)
+    elif isinstance(initial, dict):
+        labels = np.array([initial.get(node, -1)
+                          for node in range(n)], dtype=np.int64)
+    elif len(initial) and np.ndim(initial[0]) == 0 and len(initial) == n:
+        labels = np.array(initial, dtype=np.int64)
+    else:
+        labels = communities_to_label_vector(n, initial)
 
-            if Md > Mdb:
-                Mdb = Md
-                best_community = Ki_new
-                best_community_index = i
+    assigned = labels >= 0
+    _, labels[assigned] = np.unique(labels[assigned], return_inverse=True)
 
-        Mdphi = modularity(new_adj_matrix, communities)
+    return labels
 
-        if Mdb >= Mdphi and Mdb != -1:
-            communities[best_community_index] = best_community
+
+class AdaptiveBeta:
+    """
+    Online schedule of the destruction size β of IG.
+
+    The run starts with large perturbations (beta_max). β is then adjusted after every
+    iteration from the outcome of the last `window` iterations: an iteration is a success
+    when its solution is accepted with an improvement larger than min_improvement. While
+    the success rate stays above target_rate the perturbation size is productive and β
+    grows back towards beta_max, otherwise it shrinks towards beta_min. As improvements
+    get rarer and smaller late in the run, the destruction becomes finer.
+    """
+
+    def __init__(self, beta_min=.05, beta_max=.6, window=10, target_rate=.2, factor=.9, min_improvement=1e-6):
+        """
+        Parameters:
+            beta_min (float): Smallest destruction size. Default is 0.05.
+            beta_max (float): Largest (and initial) destruction size. Default is 0.6.
+            window (int): Number of recent iterations used to estimate the success rate. Default is 10.
+            target_rate (float): Success rate above which β grows. Default is 0.2.
+            factor (float): Multiplicative step applied to β after each iteration. Default is 0.9.
+            min_improvement (float): Modularity improvement below which an accepted solution isn't a success. Default is 1e-6.
+        """
+        self.beta_min = beta_min
+        self.beta_max = beta_max
+        self.target_rate = target_rate
+        self.factor = factor
+        self.min_improvement = min_improvement
+
+        self.beta = beta_max
+        self.outcomes = deque(maxlen=window)
+
+    def update(self, improvement: float) -> float:
+        """
+        Records the modularity improvement of the last iteration (0 if it was rejected) and updates β.
+
+        Returns:
+            float: The destruction size to use in the next iteration.
+        """
+        self.outcomes.append(improvement > self.min_improvement)
+
+        if np.mean(self.outcomes) > self.target_rate:
+            self.beta = min(self.beta_max, self.beta / self.factor)
         else:
-            Ki = [node]
-            communities.append(Ki)
-            Mdb = Mdphi
+            self.beta = max(self.beta_min, self.beta * self.factor)
 
-    return communities, Mdb
+        return self.beta
 
 
-def IG(adj_matrix: np.ndarray, nb_iterations=100, beta=.4) -> tuple:
+def IG(adj_matrix: np.ndarray, nb_iterations=100, beta=.4, progress=True, seed=None, record="all", callback=None, check_every=0, local_search=False,
+       time_budget_s=None, target_modularity=None, stall_iterations=None, initial=None, resolution=1.0, engine=None) -> tuple:
     """
     Iterative Greedy Algorithm (IG) for community detection in a network.
 
+    IG is an anytime algorithm: it can be stopped by any of the criteria below, or interrupted
+    (KeyboardInterrupt), and it then returns the best solution found so far.
+
     Parameters:
         adj_matrix (np.ndarray): Adjacency matrix of the network.
-        nb_iterations (int): Number of iterations for the algorithm. Default is 100.
-        beta (float): Beta parameter for the destruction phase. Default is 0.4.
+        nb_iterations (int): Number of iterations for the algorithm, None to only rely on the other
+                             stopping criteria. Default is 100.
+        beta (float | str | AdaptiveBeta): Beta parameter for the destruction phase. "adaptive" adjusts it online
+                                           with a default `AdaptiveBeta` schedule, an `AdaptiveBeta` instance
+                                           can be given to tune the schedule. Default is 0.4.
+        progress (bool): Whether to display the progress bar. Default is True.
+        seed (int | np.random.Generator | np.random.SeedSequence): Seed of the run, two runs with the same
+                                                                   seed follow the same random trajectory. Default is None.
+        record (str | int): Which solutions are kept in the traces. Default is "all".
+            - "all": the initial solution and every accepted improvement (needed for the animations).
+            - k (int): the initial solution, every k-th accepted improvement and the final solution.
+            - "final": only the final solution.
+            - "none": no communities nor frames, the modularity trace only holds the final modularity.
+        callback (callable): Called as callback(iteration, communities, modularity) on every accepted
+                             improvement, whatever the record policy. Default is None.
+        check_every (int): Debug mode, every check_every iterations the modularity returned by the reconstruction
+                           and the one of the incumbent solution are asserted equal to a full recomputation.
+                           Ignored when Python runs with -O. Default is 0 (never).
+        local_search (bool): Whether each reconstructed solution is improved with the vertex mover of `refine`
+                             before the acceptance test. Default is False.
+        time_budget_s (float): Stops once this many seconds have elapsed since the call, GCP included. Default is None.
+        target_modularity (float): Stops as soon as the modularity reaches this value. Default is None.
+        stall_iterations (int): Stops after this many consecutive iterations without improvement. Default is None.
+        initial (Partition | dict | list | np.ndarray): Warm start, see `initial_labels` for the accepted formats.
+                                                        GCP is skipped and the search starts from this solution,
+                                                        its nodes without a community are first inserted greedily.
+                                                        Default is None (start from GCP).
+        resolution (float): The resolution parameter gamma of the modularity, values above 1 favour smaller
+                            communities. The edge weights of adj_matrix are always taken into account. Default is 1.
+        engine (ModularityEngine): An engine already built on adj_matrix, reused (with the given resolution) instead of
+                                   building the CSR structure and the degrees again. Default is None.
 
     Returns:
         tuple: A tuple containing the final communities, modularity trace, communities trace, and frames.
 
     Description:
         The method starts from an initial solution φ for a given network G .
-        The initial solution is generated using the constructive method GCP
-        The algorithm stops after performing nb_iterations iterations.
+        The initial solution is generated using the constructive method GCP, or given (warm start)
+        The algorithm stops after performing nb_iterations iterations, or earlier when a stopping criterion is met.
         Each iteration starts with a destruction phase .
         After that, the solution obtained is subjected to a reconstruction process 
         The reconstructed solution φ′ is then accepted if it gives better modularity.
+        The modularity of the incumbent solution is tracked, so the acceptance test reuses the score
+        returned by the reconstruction instead of recomputing both modularities.
     """
+    start = time.perf_counter()
+
+    if record not in ("all", "final", "none") and not (isinstance(record, int) and record > 0):
+        raise ValueError(
+            "record must be 'all', 'final', 'none' or a positive integer")
+
     frames = []
     modularity_trace = []
     communities_trace = []
 
-    communities, mod = GCP(adj_matrix)
-
-    modularity_trace.append(mod)
-    frames.append(communities_to_frame(adj_matrix.shape[0], communities, mod))
-    communities_trace.append(communities)
-
-    for _ in tqdm(range(nb_iterations), desc="IG", total=nb_iterations):
-        removed_nodes, filtered_communities = destruct(
-            adj_matrix, communities, beta)
-
-        new_communities, mod = reconstruct(
-            adj_matrix, filtered_communities, removed_nodes)
-
-        if modularity(adj_matrix, new_communities) > modularity(adj_matrix, communities):
-            communities = new_communities
-            modularity_trace.append(mod)
+    def save(communities, mod):
+        modularity_trace.append(mod)
+        if record != "none":
             communities_trace.append(communities)
             frames.append(communities_to_frame(
                 adj_matrix.shape[0], communities, mod))
 
+    if beta == "adaptive":
+        beta = AdaptiveBeta()
+    schedule = beta if isinstance(beta, AdaptiveBeta) else None
+
+    rng = np.random.default_rng(seed)
+
+    if engine is None:
+        engine = ModularityEngine(adj_matrix, resolution)
+
+    if initial is None:
+        communities, mod = GCP(adj_matrix, rng, engine, resolution)
+        labels = communities_to_label_vector(adj_matrix.shape[0], communities)
+    else:
+        labels = initial_labels(adj_matrix, initial)
+        labels, mod = reconstruct(adj_matrix, labels, rng.permutation(
+            np.flatnonzero(labels < 0)), engine, resolution)
+        communities = label_vector_to_communities(labels)
+
+    best_mod = mod
+    nb_improvements = 0
+    nb_stalled = 0
+    saved = record not in ("final", "none")
+
+    if saved:
+        save(communities, mod)
+
+    iterations = count() if nb_iterations is None else range(nb_iterations)
+
+    try:
+        for iteration in tqdm(iterations, desc="IG", total=nb_iterations, disable=not progress):
+            if target_modularity is not None and best_mod >= target_modularity:
+                break
+            if time_budget_s is not None and time.perf_counter() - start >= time_budget_s:
+                break
+            if stall_iterations is not None and nb_stalled >= stall_iterations:
+                break
+
+            removed_nodes, _, filtered_labels = destruct(
+                adj_matrix, labels, schedule.beta if schedule else beta, rng)
+
+            new_labels, mod = reconstruct(
+                adj_matrix, filtered_labels, removed_nodes, engine, resolution)
+
+            if local_search:
+                new_labels, mod = refine(
+                    adj_matrix, new_labels, engine, rng, resolution)
+
+            if __debug__ and check_every and iteration % check_every == 0:
+                expected = labels_modularity(
+                    adj_matrix, new_labels, resolution=resolution, degrees=engine.degrees)
+                assert np.isclose(mod, expected), \
+                    f"reconstruct returned {mod}, expected {expected}"
+                expected = labels_modularity(
+                    adj_matrix, labels, resolution=resolution, degrees=engine.degrees)
+                assert np.isclose(best_mod, expected), \
+                    f"incumbent modularity is {best_mod}, expected {expected}"
+
+            if schedule:
+                schedule.update(mod - best_mod)
+
+            if mod > best_mod:
+                labels = new_labels
+                best_mod = mod
+                nb_improvements += 1
+                nb_stalled = 0
+
+                saved = record == "all" or (
+                    isinstance(record, int) and nb_improvements % record == 0)
+                if saved or callback is not None:
+                    communities = label_vector_to_communities(labels)
+                if saved:
+                    save(communities, mod)
+
+                if callback is not None:
+                    callback(iteration, communities, mod)
+            else:
+                nb_stalled += 1
+    except KeyboardInterrupt:
+        # anytime behaviour: keep the best solution found so far
+        pass
+
+    communities = label_vector_to_communities(labels)
+
+    if not saved:
+        save(communities, best_mod)
+
     return communities, modularity_trace, communities_trace, frames
+
+
+def _msig_restart(restart: int, seed: np.random.SeedSequence, nb_iterations: int, beta: float, target_modularity: float,
+                  resolution: float) -> tuple:
+    """
+    Runs one IG restart on the shared adjacency matrix.
+    """
+    adj_matrix = worker_graph().adj_matrix
+
+    communities, modularity_trace, _, _ = IG(
+        adj_matrix, nb_iterations, beta, progress=False, seed=seed, record="none", target_modularity=target_modularity,
+        resolution=resolution)
+
+    return restart, communities, modularity_trace[-1]
+
+
+def msig(adj_matrix: np.ndarray, nb_restarts=10, nb_iterations=20, beta=.4, target_modularity=None, max_workers=None, seed=None,
+         resolution=1.0) -> tuple:
+    """
+    Multi-Start Iterative Greedy (MSIG).
+
+    MSIG runs IG from several solutions generated by the randomized constructive procedure GCP
+    and keeps the best one. The restarts are independent, so they are fanned out over a pool
+    of processes: the adjacency matrix is placed once in shared memory as CSR arrays (see
+    `SharedGraph`), and each worker attaches it instead of receiving a pickled copy per restart.
+
+    Parameters:
+        adj_matrix (np.ndarray): Adjacency matrix of the network.
+        nb_restarts (int): Number of IG restarts. Default is 10.
+        nb_iterations (int): Number of iterations of each IG restart. Default is 20.
+        beta (float | str | AdaptiveBeta): Beta parameter for the destruction phase, see `IG`. Default is 0.4.
+        target_modularity (float): Each restart stops once it reaches this modularity, and the restarts that
+                                   have not started yet are then cancelled. Default is None (run every restart).
+        max_workers (int): Number of worker processes. Default is None (number of CPUs).
+        seed (int): Seed from which the independent random stream of each restart is spawned. Default is None.
+        resolution (float): The resolution parameter gamma of the modularity, see `IG`. Default is 1.
+
+    Returns:
+        tuple: A tuple containing the best communities and the trace of the finished restarts.
+    """
+    seeds = np.random.SeedSequence(seed).spawn(nb_restarts)
+
+    best_communities = None
+    best_modularity = -np.inf
+    msig_trace = []
+
+    with SharedGraph(adj_matrix) as graph, \
+            ProcessPoolExecutor(max_workers, initializer=attach_worker, initargs=(graph.handle,)) as executor:
+        futures = [executor.submit(_msig_restart, restart, seeds[restart], nb_iterations, beta, target_modularity,
+                                   resolution)
+                   for restart in range(nb_restarts)]
+
+        for future in as_completed(futures):
+            restart, communities, mod = future.result()
+
+            msig_trace.append(
+                {"restart": restart, "communities": communities, "modularity": mod})
+
+            if mod > best_modularity:
+                best_modularity = mod
+                best_communities = communities
+
+            if target_modularity is not None and best_modularity >= target_modularity:
+                for pending in futures:
+                    pending.cancel()
+                break
+
+    return best_communities, msig_trace
@@ -0,0 +1,396 @@
+import numpy as np
+from collections import deque
+from scipy import sparse
+from utils.communities_network import label_vector_to_communities
+from utils import ig_kernels
+
+
+class ModularityEngine:
+    """
+    Incremental modularity bookkeeping for the reconstruction phase of IG.
+
+    The engine works on the subgraph induced by the nodes currently placed in a
+    community (the "active" nodes), exactly like `subgraph_modularity` does with
+    the same mask, but updates the result incrementally. For it, the engine keeps:
+        - the degree of every node inside the active subgraph,
+        - the total degree, internal weight and size of every community,
+        - the total weight of the active subgraph.
+
+    Inserting a node only touches its neighbours, so scoring every candidate
+    community for that node costs O(deg(v)) instead of one full modularity
+    computation per community.
+
+    All modularity values returned by the engine are on the same scale as
+    `communities_network.modularity`, with the edge weights and the resolution
+    gamma of the engine. The resolution can be changed between two `reset` calls
+    without rebuilding the CSR structure or the degree vector.
+    """
+
+    # whether `insert_nodes` may run the compiled kernels of `ig_kernels` on the CSR arrays
+    use_kernels = True
+
+    def __init__(self, adj_matrix, resolution: float = 1.0):
+        """
+        Builds the CSR structure of the graph once, it is shared by every reconstruction.
+
+        Parameters:
+            adj_matrix (np.ndarray | scipy.sparse matrix): The adjacency matrix of the network.
+            resolution (float): The resolution parameter gamma of the modularity. Default is 1.
+        """
+        csr = sparse.csr_matrix(adj_matrix, dtype=np.float64)
+        csr.sum_duplicates()
+
+        self.n = csr.shape[0]
+        self.indptr = csr.indptr
+        self.indices = csr.indices
+        self.data = csr.data
+        self.rows = np.repeat(np.arange(self.n), np.diff(self.indptr))
+        self.self_loops = csr.diagonal()
+        self.resolution = resolution
+
+        # weighted degrees in the whole graph, reused whenever every node is active
+        self.degrees = np.bincount(self.rows, weights=self.data, minlength=self.n).astype(np.float64)
+
+        self.reset()
+
+    def reset(self, labels: np.ndarray = None):
+        """
+        Loads a (partial) solution in the engine.
+
+        Nodes labelled -1 are considered as removed, they are not part of the active
+        subgraph until they are inserted back.
+
+        Parameters:
+            labels (np.ndarray): The community index of each node, every node is removed if not given.
+        """
+        if labels is None:
+            self.labels = np.full(self.n, -1, dtype=np.int64)
+        else:
+            self.labels = np.array(labels, dtype=np.int64)
+
+        self.active = self.labels >= 0
+        self.next_label = self.labels.max(initial=-1) + 1
+
+        rows, cols = self.rows, self.indices
+        active_edges = self.active[rows] & self.active[cols]
+
+        # degrees inside the active subgraph
+        if self.active.all():
+            self.k = self.degrees.astype(np.float64)
+        else:
+            self.k = np.bincount(rows[active_edges], weights=self.data[active_edges],
+                                 minlength=self.n).astype(np.float64)
+        self.two_m = self.k.sum()
+        self.sum_k2 = np.square(self.k).sum()
+        self.trace = self.self_loops[self.active].sum()
+
+        # per community aggregates, a partition never has more than n communities
+        active_nodes = np.flatnonzero(self.active)
+        self.sizes = np.bincount(
+            self.labels[active_nodes], minlength=self.n)
+        self.degree_sums = np.bincount(
+            self.labels[active_nodes], weights=self.k[active_nodes], minlength=self.n).astype(np.float64)
+
+        internal = active_edges & (self.labels[rows] == self.labels[cols])
+        self.internal_weights = np.bincount(
+            self.labels[rows[internal]], weights=self.data[internal], minlength=self.n).astype(np.float64)
+
+    def snapshot(self) -> tuple:
+        """
+        Returns a copy of the current solution and of its aggregates, see `restore`.
+        """
+        return (self.labels.copy(), self.active.copy(), self.k.copy(), self.sizes.copy(),
+                self.degree_sums.copy(), self.internal_weights.copy(),
+                self.two_m, self.sum_k2, self.trace, self.next_label)
+
+    def restore(self, snapshot: tuple):
+        """
+        Goes back to a solution saved by `snapshot`, in O(n) instead of the O(m) of `reset`.
+
+        Parameters:
+            snapshot (tuple): The value returned by `snapshot`, the graph must not have changed since.
+        """
+        arrays = (self.labels, self.active, self.k, self.sizes, self.degree_sums, self.internal_weights)
+        for array, saved in zip(arrays, snapshot[:6]):
+            np.copyto(array, saved)
+
+        self.two_m, self.sum_k2, self.trace, self.next_label = snapshot[6:]
+
+    def _new_label(self) -> int:
+        """
+        Returns an unused community index.
+        """
+        if self.next_label < self.n:
+            label = self.next_label
+            self.next_label += 1
+            return label
+
+        # every index has been used once, recycle an empty community
+        return int(np.flatnonzero(self.sizes == 0)[0])
+
+    def _neighbours(self, node: int) -> tuple:
+        """
+        Returns the active neighbours of a node (self-loop excluded) and the weights of the links.
+        """
+        start, end = self.indptr[node], self.indptr[node + 1]
+        neighbours = self.indices[start:end]
+        weights = self.data[start:end]
+
+        linked = self.active[neighbours] & (neighbours != node)
+
+        return neighbours[linked], weights[linked]
+
+    def _community_links(self, neighbours: np.ndarray, weights: np.ndarray) -> tuple:
+        """
+        Returns the communities of the neighbours and the weight of the links towards each of them.
+        """
+        candidates, inverse = np.unique(
+            self.labels[neighbours], return_inverse=True)
+
+        return candidates, np.bincount(inverse, weights=weights)
+
+    def insert(self, node: int, allow_ties=True, community: int = None) -> int:
+        """
+        Inserts a removed node in the community that maximizes the modularity.
+
+        The gain of adding the node v to a community c, compared to leaving it alone
+        in a new community, is:
+            w(v, c) / 2m - gamma * k_v * K_c / (2m)^2
+        where w(v, c) is the weight of the links between v and c, k_v the degree of v
+        and K_c the total degree of c, all taken in the active subgraph once v is added.
+        Joining a community that v is not linked to can never increase the modularity,
+        so only the communities of the neighbours of v are scored.
+
+        Parameters:
+            node (int): The node to insert.
+            allow_ties (bool): Whether the node joins the best community when the gain is exactly zero.
+            community (int): Forces the community of the node instead of choosing the best one.
+
+        Returns:
+            int: The index of the community the node was inserted in.
+        """
+        neighbours, weights = self._neighbours(node)
+
+        self_loop = self.self_loops[node]
+        k_v = weights.sum() + self_loop
+
+        # the node joins the active subgraph: its neighbours' degrees grow
+        neighbours_labels = self.labels[neighbours]
+        self.sum_k2 += (np.square(self.k[neighbours] + weights) -
+                        np.square(self.k[neighbours])).sum()
+        self.k[neighbours] += weights
+        np.add.at(self.degree_sums, neighbours_labels, weights)
+        self.two_m += 2 * weights.sum() + self_loop
+
+        best_community = -1
+        best_links = 0.0
+
+        if community is not None:
+            best_community = community
+            best_links = weights[neighbours_labels == community].sum()
+        elif len(neighbours) and self.two_m > 0:
+            candidates, links = self._community_links(neighbours, weights)
+
+            gains = links / self.two_m - self.resolution * k_v * \
+                self.degree_sums[candidates] / self.two_m ** 2
+
+            best = np.argmax(gains)
+            if gains[best] > 0 or (allow_ties and gains[best] == 0):
+                best_community = candidates[best]
+                best_links = links[best]
+
+        if best_community < 0:
+            best_community = self._new_label()
+
+        self.labels[node] = best_community
+        self.active[node] = True
+        self.k[node] = k_v
+        self.sum_k2 += k_v ** 2
+        self.trace += self_loop
+
+        self.sizes[best_community] += 1
+        self.degree_sums[best_community] += k_v
+        self.internal_weights[best_community] += 2 * best_links + self_loop
+
+        return best_community
+
+    def insert_nodes(self, nodes, allow_ties=True):
+        """
+        Inserts removed nodes one after the other, like successive calls to `insert`.
+
+        The loop runs in a Numba kernel when Numba is installed (see `ig_kernels`), the
+        resulting partition is the same as with `insert`.
+
+        Parameters:
+            nodes (list): The nodes to insert, in insertion order.
+            allow_ties (bool): Whether a node joins the best community when the gain is exactly zero.
+        """
+        ig_kernels.insert_nodes(self, nodes, allow_ties)
+
+    def remove(self, node: int):
+        """
+        Removes an active node from its community and from the active subgraph, the inverse of `insert`.
+
+        Parameters:
+            node (int): The node to remove.
+        """
+        neighbours, weights = self._neighbours(node)
+        neighbours_labels = self.labels[neighbours]
+
+        community = self.labels[node]
+        self_loop = self.self_loops[node]
+        k_v = self.k[node]
+        links = weights[neighbours_labels == community].sum()
+
+        self.sizes[community] -= 1
+        self.degree_sums[community] -= k_v
+        self.internal_weights[community] -= 2 * links + self_loop
+
+        self.labels[node] = -1
+        self.active[node] = False
+        self.k[node] = 0
+        self.sum_k2 -= k_v ** 2
+        self.trace -= self_loop
+
+        # the node leaves the active subgraph: its neighbours' degrees shrink
+        self.sum_k2 += (np.square(self.k[neighbours] - weights) -
+                        np.square(self.k[neighbours])).sum()
+        self.k[neighbours] -= weights
+        np.add.at(self.degree_sums, neighbours_labels, -weights)
+        self.two_m -= 2 * weights.sum() + self_loop
+
+    def remove_nodes(self, nodes):
+        """
+        Removes active nodes one after the other, like successive calls to `remove`.
+
+        The loop runs in a Numba kernel when Numba is installed (see `ig_kernels`).
+
+        Parameters:
+            nodes (list): The nodes to remove.
+        """
+        ig_kernels.remove_nodes(self, nodes)
+
+    def move(self, node: int, tolerance=1e-12) -> bool:
+        """
+        Moves an active node to the community that maximizes the modularity (Louvain move).
+
+        With K_c taken without v, the gain of v being in c is w(v, c) / 2m - gamma * k_v * K_c / (2m)^2
+        (0 for a new community), and v is moved when another community beats its own one.
+
+        Parameters:
+            node (int): The node to move.
+            tolerance (float): Minimum modularity gain of a move, avoids looping on rounding errors.
+
+        Returns:
+            bool: Whether the node has been moved.
+        """
+        if self.two_m == 0:
+            return False
+
+        neighbours, weights = self._neighbours(node)
+        candidates, links = self._community_links(neighbours, weights)
+
+        current = self.labels[node]
+        k_v = self.k[node]
+        own = candidates == current
+
+        current_links = links[own].sum()
+        current_gain = current_links / self.two_m - self.resolution * k_v * \
+            (self.degree_sums[current] - k_v) / self.two_m ** 2
+
+        gains = links / self.two_m - self.resolution * k_v * \
+            self.degree_sums[candidates] / self.two_m ** 2
+        gains[own] = -np.inf
+
+        # leaving v alone in a new community has a null gain
+        best_gain = 0.0
+        target = -1
+        target_links = 0.0
+        if len(candidates) and gains.max() > best_gain:
+            best = np.argmax(gains)
+            best_gain = gains[best]
+            target = candidates[best]
+            target_links = links[best]
+
+        if best_gain - current_gain <= tolerance:
+            return False
+
+        if target < 0:
+            target = self._new_label()
+
+        self_loop = self.self_loops[node]
+
+        self.sizes[current] -= 1
+        self.degree_sums[current] -= k_v
+        self.internal_weights[current] -= 2 * current_links + self_loop
+
+        self.labels[node] = target
+        self.sizes[target] += 1
+        self.degree_sums[target] += k_v
+        self.internal_weights[target] += 2 * target_links + self_loop
+
+        return True
+
+    def local_search(self, order=None) -> int:
+        """
+        Local improvement phase: moves single nodes until no move increases the modularity.
+
+        Every active node starts in a queue of dirty nodes. When a node moves, its
+        neighbours are queued again since their best community may have changed.
+
+        Parameters:
+            order (list): The order in which the nodes are first visited. Default is None (node index order).
+
+        Returns:
+            int: The number of moves performed.
+        """
+        if order is None:
+            order = range(self.n)
+
+        queue = deque(node for node in order if self.active[node])
+        dirty = np.zeros(self.n, dtype=bool)
+        dirty[list(queue)] = True
+
+        nb_moves = 0
+        while queue:
+            node = queue.popleft()
+            dirty[node] = False
+
+            if not self.move(node):
+                continue
+
+            nb_moves += 1
+            neighbours, _ = self._neighbours(node)
+            for neighbour in neighbours[~dirty[neighbours]]:
+                dirty[neighbour] = True
+                queue.append(neighbour)
+
+        return nb_moves
+
+    def modularity(self) -> float:
+        """
+        Calculates the modularity of the active subgraph from the community aggregates.
+
+        This is `subgraph_modularity(adj_matrix, self.to_communities(), self.active, self.resolution)` in O(n)
+        vectorised operations instead of a pass over the edges.
+
+        Returns:
+            float: The modularity value, -1 if the active nodes aren't linked.
+        """
+        if self.two_m == 0:
+            return -1
+
+        internal = (self.internal_weights.sum() - self.trace) / self.two_m
+        expected = (np.square(self.degree_sums).sum() -
+                    self.sum_k2) / self.two_m ** 2
+
+        return 0.5 * (internal - self.resolution * expected)
+
+    def to_communities(self) -> list:
+        """
+        Converts the labels of the active nodes into a list of communities.
+
+        Returns:
+            list: A list of communities, where each community is represented as a list of node indices.
+        """
+        return label_vector_to_communities(self.labels)
@@ -0,0 +1,140 @@
+import numpy as np
+from utils.communities_network import labels_modularity
+
+
+class Partition:
+    """
+    Compact representation of a partition of the nodes of a network.
+
+    Every node belongs to exactly one community, nodes missing from the source
+    solution are placed alone in their own community.
+
+    Attributes:
+        labels (np.ndarray): The community index (int32) of each node, communities are numbered from 0.
+        sizes (np.ndarray): The number of nodes of each community.
+        degree_sums (np.ndarray): The total degree of each community.
+        degrees (np.ndarray): The degree of each node.
+    """
+
+    def __init__(self, labels: np.ndarray, degrees: np.ndarray):
+        """
+        Parameters:
+            labels (np.ndarray): Any integer label for each node, -1 for the nodes without a community.
+            degrees (np.ndarray): The degree of each node.
+        """
+        labels = np.array(labels, dtype=np.int64)
+
+        # nodes without a community become singletons
+        missing = labels < 0
+        labels[missing] = labels.max(initial=-1) + 1 + np.arange(missing.sum())
+
+        _, labels = np.unique(labels, return_inverse=True)
+
+        self.labels = labels.astype(np.int32)
+        self.degrees = np.asarray(degrees, dtype=np.float64)
+        self.sizes = np.bincount(self.labels)
+        self.degree_sums = np.bincount(self.labels, weights=self.degrees)
+
+    @staticmethod
+    def _degrees(adj_matrix) -> np.ndarray:
+        return np.asarray(adj_matrix.sum(axis=1), dtype=np.float64).ravel()
+
+    @classmethod
+    def from_labels(cls, adj_matrix, labels) -> "Partition":
+        """
+        Builds a partition from a vector of labels, e.g. the labels returned by `kmeans_clustering`.
+
+        Parameters:
+            adj_matrix (np.ndarray | scipy.sparse matrix): The adjacency matrix of the network.
+            labels (list | np.ndarray): The community label of each node.
+
+        Returns:
+            Partition: The partition.
+        """
+        return cls(labels, cls._degrees(adj_matrix))
+
+    @classmethod
+    def from_communities(cls, adj_matrix, communities: list) -> "Partition":
+        """
+        Builds a partition from a list of communities, e.g. the communities returned by `IG`.
+
+        Parameters:
+            adj_matrix (np.ndarray | scipy.sparse matrix): The adjacency matrix of the network.
+            communities (list): A list of communities, where each community is represented as a list of node indices.
+
+        Returns:
+            Partition: The partition.
+        """
+        labels = np.full(adj_matrix.shape[0], -1, dtype=np.int64)
+        for index, community in enumerate(communities):
+            labels[np.asarray(list(community), dtype=np.int64)] = index
+
+        return cls(labels, cls._degrees(adj_matrix))
+
+    @classmethod
+    def from_dict(cls, adj_matrix, partition: dict, nodes: list = None) -> "Partition":
+        """
+        Builds a partition from a dictionary mapping each node to its community, e.g. the partition returned by `louvain`.
+
+        Parameters:
+            adj_matrix (np.ndarray | scipy.sparse matrix): The adjacency matrix of the network.
+            partition (dict): The community of each node.
+            nodes (list): The nodes in the order of the adjacency matrix (list(G.nodes())), the keys of partition
+                          are taken as node indices if not given.
+
+        Returns:
+            Partition: The partition.
+        """
+        if nodes is None:
+            nodes = range(adj_matrix.shape[0])
+
+        labels = [partition.get(node, -1) for node in nodes]
+
+        return cls(labels, cls._degrees(adj_matrix))
+
+    @property
+    def nb_communities(self) -> int:
+        return len(self.sizes)
+
+    def to_communities(self) -> list:
+        """
+        Converts the partition into a list of communities.
+
+        Returns:
+            list: A list of communities, where each community is represented as a list of node indices.
+        """
+        nodes = np.argsort(self.labels, kind="stable")
+        boundaries = np.cumsum(self.sizes)[:-1]
+
+        return [community.tolist() for community in np.split(nodes, boundaries)]
+
+    def to_dict(self, nodes: list = None) -> dict:
+        """
+        Converts the partition into a dictionary mapping each node to its community, like `louvain` does.
+
+        Parameters:
+            nodes (list): The nodes in the order of the adjacency matrix (list(G.nodes())), node indices are used if not given.
+
+        Returns:
+            dict: The community of each node.
+        """
+        if nodes is None:
+            nodes = range(len(self.labels))
+
+        return {node: int(label) for node, label in zip(nodes, self.labels)}
+
+    def modularity(self, adj_matrix, resolution: float = 1.0) -> float:
+        """
+        Calculates the modularity of the partition, see `labels_modularity`.
+
+        The cached degrees are reused, so evaluating the partition at several resolutions
+        only costs one pass over the edges each.
+
+        Parameters:
+            adj_matrix (np.ndarray | scipy.sparse matrix): The adjacency matrix of the network.
+            resolution (float): The resolution parameter gamma. Default is 1.
+
+        Returns:
+            float: The modularity value of the network.
+        """
+        return labels_modularity(adj_matrix, self.labels, resolution=resolution, degrees=self.degrees)
@@ -0,0 +1,162 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+from multiprocessing import shared_memory
+from scipy import sparse
+
+BACKENDS = ("shared_memory", "memmap")
+
+# graph attached by the current worker process, see `attach_worker`
+_worker_graph = None
+
+
+class SharedGraph:
+    """
+    Adjacency matrix stored once as CSR arrays in shared memory or in memory-mapped files.
+
+    The owner process builds the container, and worker processes attach it from its `handle`,
+    a small picklable dictionary (names, dtypes and shapes of the arrays). Attaching maps the
+    existing buffers instead of copying them, so handing a graph to a pool of workers costs
+    the same whatever its size. Dense arrays derived from the graph (e.g. a distance matrix)
+    can be shared the same way as extra arrays.
+
+    Attributes:
+        adj_matrix (scipy.sparse.csr_matrix): The adjacency matrix, built on top of the shared buffers.
+        arrays (dict): The extra arrays, by name.
+        handle (dict): What a worker needs to attach the graph.
+    """
+
+    def __init__(self, adj_matrix, backend="shared_memory", directory=None, **arrays):
+        """
+        Copies the adjacency matrix (and the extra arrays) in shared buffers.
+
+        Parameters:
+            adj_matrix (np.ndarray | scipy.sparse matrix): The adjacency matrix of the network.
+            backend (str): "shared_memory" (multiprocessing.shared_memory blocks) or "memmap" (.npy files mapped
+                           by every process, for graphs that do not fit in RAM). Default is "shared_memory".
+            directory (str): Where the memmap files are written, a temporary directory is used if not given.
+            arrays: Extra dense arrays to share alongside the graph.
+        """
+        if backend not in BACKENDS:
+            raise ValueError(f"backend must be one of {BACKENDS}")
+
+        csr = sparse.csr_matrix(adj_matrix, dtype=np.float64, copy=True)
+
+        # canonical arrays, the workers only read them (a memmap is read-only)
+        csr.sum_duplicates()
+        csr.sort_indices()
+
+        self._owner = True
+        self._blocks = []
+        self._directory = None
+        if backend == "memmap":
+            self._directory = tempfile.mkdtemp(dir=directory, prefix="shared_graph_")
+
+        sources = {"data": csr.data, "indices": csr.indices, "indptr": csr.indptr}
+        sources.update({name: np.asarray(array) for name, array in arrays.items()})
+
+        buffers = {}
+        for name, array in sources.items():
+            if backend == "shared_memory":
+                block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                self._blocks.append(block)
+                location = block.name
+            else:
+                location = os.path.join(self._directory, f"{name}.npy")
+                np.save(location, array)
+
+            buffers[name] = (location, array.dtype.str, array.shape)
+
+        self.handle = {"backend": backend, "shape": csr.shape, "buffers": buffers}
+        self._map()
+
+        if backend == "shared_memory":
+            for name, array in sources.items():
+                self._views[name][...] = array
+
+    @classmethod
+    def attach(cls, handle: dict) -> "SharedGraph":
+        """
+        Maps a graph created by another process, without copying it.
+
+        Parameters:
+            handle (dict): The `handle` of the owner SharedGraph.
+
+        Returns:
+            SharedGraph: A view of the graph, closing it does not free the shared buffers.
+        """
+        graph = cls.__new__(cls)
+        graph._owner = False
+        graph._blocks = []
+        graph._directory = None
+        graph.handle = handle
+        graph._map()
+
+        return graph
+
+    def _map(self):
+        """
+        Builds the numpy views on the shared buffers, and the CSR matrix on top of them.
+        """
+        self._views = {}
+        for index, (name, (location, dtype, shape)) in enumerate(self.handle["buffers"].items()):
+            if self.handle["backend"] == "memmap":
+                self._views[name] = np.load(location, mmap_mode="r")
+                continue
+
+            if not self._owner:
+                self._blocks.append(shared_memory.SharedMemory(name=location))
+            self._views[name] = np.ndarray(shape, np.dtype(dtype), buffer=self._blocks[index].buf)
+
+        self.adj_matrix = sparse.csr_matrix(
+            (self._views["data"], self._views["indices"], self._views["indptr"]), shape=self.handle["shape"], copy=False)
+        self.arrays = {name: view for name, view in self._views.items()
+                       if name not in ("data", "indices", "indptr")}
+
+    def close(self):
+        """
+        Releases the buffers of this process, the owner also frees them for every process.
+        """
+        self.adj_matrix = None
+        self.arrays = {}
+        self._views = {}
+
+        for block in self._blocks:
+            try:
+                block.close()
+            except BufferError:
+                # a view of the block is still referenced, the mapping is released with it
+                pass
+            if self._owner:
+                block.unlink()
+        self._blocks = []
+
+        if self._owner and self._directory is not None:
+            shutil.rmtree(self._directory, ignore_errors=True)
+            self._directory = None
+
+    def __enter__(self) -> "SharedGraph":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def attach_worker(handle: dict) -> None:
+    """
+    Process pool initializer: attaches the shared graph once per worker process.
+
+    Parameters:
+        handle (dict): The `handle` of the SharedGraph created by the parent process.
+    """
+    global _worker_graph
+
+    _worker_graph = SharedGraph.attach(handle)
+
+
+def worker_graph() -> SharedGraph:
+    """
+    Returns the graph attached by `attach_worker` in the current worker process.
+    """
+    return _worker_graph
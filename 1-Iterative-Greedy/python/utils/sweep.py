@@ -0,0 +1,152 @@
+import os
+import time
+import numpy as np
+import networkx as nx
+import community as community_louvain
+from concurrent.futures import ProcessPoolExecutor
+from utils.iterative_greedy_algorithm import IG
+from utils.shared_graph import SharedGraph, attach_worker, worker_graph
+from utils.communities_network import labels_modularity, communities_to_label_vector
+from utils.modularity_engine import ModularityEngine
+
+ALGORITHMS = ("ig", "louvain")
+
+# graph attached by each sweep worker process: adjacency matrix, engine and networkx graph
+_sweep_graph = None
+
+
+def _attach_sweep(handle: dict) -> None:
+    """
+    Worker initializer: attaches the shared CSR arrays and builds the engine (CSR structure,
+    degrees and total weight) once for all the points run by the worker.
+    """
+    global _sweep_graph
+
+    attach_worker(handle)
+    adj_matrix = worker_graph().adj_matrix
+
+    _sweep_graph = {"adj_matrix": adj_matrix,
+                    "engine": ModularityEngine(adj_matrix), "graph": None}
+
+
+def _louvain_point(labels: np.ndarray, resolution: float, rng: np.random.Generator) -> np.ndarray:
+    """
+    Runs Louvain at one resolution, starting from labels when given.
+    """
+    if _sweep_graph["graph"] is None:
+        _sweep_graph["graph"] = nx.from_scipy_sparse_array(
+            _sweep_graph["adj_matrix"])
+
+    partition = None
+    if labels is not None:
+        partition = {node: int(label) for node, label in enumerate(labels)}
+
+    partition = community_louvain.best_partition(
+        _sweep_graph["graph"], partition, resolution=resolution, random_state=int(rng.integers(2 ** 31)))
+
+    return np.array([partition[node] for node in range(len(partition))])
+
+
+def _sweep_chain(algorithm: str, beta: float, resolutions: np.ndarray, seed: np.random.SeedSequence,
+                 nb_iterations: int, warm_start: bool, ig_kwargs: dict) -> list:
+    """
+    Runs the points of one chain (same algorithm and beta, increasing resolutions) one after the other,
+    each point starting from the solution of the previous one.
+    """
+    adj_matrix = _sweep_graph["adj_matrix"]
+    engine = _sweep_graph["engine"]
+    rng = np.random.default_rng(seed)
+
+    rows = []
+    labels = None
+    for resolution in resolutions:
+        start = time.perf_counter()
+
+        if algorithm == "ig":
+            communities, _, _, _ = IG(adj_matrix, nb_iterations, beta, progress=False, seed=rng, record="none",
+                                      initial=labels, resolution=resolution, engine=engine, **ig_kwargs)
+            new_labels = communities_to_label_vector(
+                adj_matrix.shape[0], communities)
+        else:
+            new_labels = _louvain_point(labels, resolution, rng)
+
+        rows.append({
+            "algorithm": algorithm,
+            "resolution": resolution,
+            "beta": beta,
+            "modularity": labels_modularity(adj_matrix, new_labels, resolution=resolution, degrees=engine.degrees),
+            "modularity_gamma_1": labels_modularity(adj_matrix, new_labels, degrees=engine.degrees),
+            "nb_communities": len(np.unique(new_labels)),
+            "time_s": time.perf_counter() - start,
+            "warm_started": labels is not None,
+            "labels": new_labels,
+        })
+
+        if warm_start:
+            labels = new_labels
+
+    return rows
+
+
+def sweep(adj_matrix, resolutions=(1.0,), betas=(.4,), algorithms=("ig",), nb_iterations=50, warm_start=True,
+          max_workers=None, seed=None, output=None, **ig_kwargs) -> dict:
+    """
+    Runs IG and/or Louvain over a grid of resolutions (and of beta values for IG).
+
+    The adjacency matrix is placed once in shared memory as CSR arrays (see `SharedGraph`), and each worker
+    process builds the CSR structure, the degrees and the total weight of the graph once in a
+    `ModularityEngine` reused by all its points. The grid is cut into chains of neighbouring points
+    (same algorithm and beta, consecutive resolutions) spread over the workers; along a chain, each
+    point is warm-started from the solution of the previous resolution, so it converges in a few
+    iterations instead of rebuilding a solution from scratch.
+
+    Parameters:
+        adj_matrix (np.ndarray | scipy.sparse matrix): Adjacency matrix of the network.
+        resolutions (list): The resolution parameters gamma. Default is (1,).
+        betas (list): The beta parameters of IG, ignored by Louvain. Default is (0.4,).
+        algorithms (list): The algorithms to run, among "ig" and "louvain". Default is ("ig",).
+        nb_iterations (int): Number of iterations of each IG run. Default is 50.
+        warm_start (bool): Whether each point starts from the solution of the previous point of its chain. Default is True.
+        max_workers (int): Number of worker processes. Default is None (number of CPUs).
+        seed (int): Seed from which the random stream of each chain is spawned. Default is None.
+        output (str): Path of the .npz file the results are written to, one array per column. Default is None.
+        ig_kwargs: Other arguments of `IG` (e.g. stall_iterations, local_search).
+
+    Returns:
+        dict: The results as columns, one entry per point sorted by algorithm, beta and resolution:
+              algorithm, resolution, beta (nan for Louvain), modularity (at the point's resolution),
+              modularity_gamma_1, nb_communities, time_s, warm_started and labels (one row per point).
+    """
+    unknown = set(algorithms) - set(ALGORITHMS)
+    if unknown:
+        raise ValueError(f"unknown algorithms {sorted(unknown)}, expected some of {ALGORITHMS}")
+
+    resolutions = np.sort(np.asarray(resolutions, dtype=np.float64))
+    max_workers = max_workers or os.cpu_count()
+
+    chains = []
+    for algorithm in algorithms:
+        chain_betas = betas if algorithm == "ig" else [np.nan]
+
+        # enough chains to keep every worker busy, each one a run of consecutive resolutions
+        nb_segments = min(len(resolutions), max(1, -(-max_workers // (len(algorithms) * len(chain_betas)))))
+        for beta in chain_betas:
+            for segment in np.array_split(resolutions, nb_segments):
+                chains.append((algorithm, beta, segment))
+
+    seeds = np.random.SeedSequence(seed).spawn(len(chains))
+
+    with SharedGraph(adj_matrix) as graph, \
+            ProcessPoolExecutor(max_workers, initializer=_attach_sweep, initargs=(graph.handle,)) as executor:
+        futures = [executor.submit(_sweep_chain, algorithm, beta, segment, chain_seed, nb_iterations,
+                                   warm_start, ig_kwargs)
+                   for (algorithm, beta, segment), chain_seed in zip(chains, seeds)]
+
+        rows = [row for future in futures for row in future.result()]
+
+    columns = {name: np.array([row[name] for row in rows]) for name in rows[0]}
+
+    if output is not None:
+        np.savez_compressed(output, **columns)
+
+    return columns
@@ -3,7 +3,7 @@ from utils.communities_network import modularity_matrix, modularity, filter_adj_
 from tqdm.notebook import tqdm
 
 
-def GCP(adj_matrix: np.ndarray) -> list:
+def GCP(adj_matrix: np.ndarray, resolution: float = 1.0) -> list:
     """
     Greedy Constructive Procedure (GCP) for generating an initial solution for the iterative greedy metaheuristic.
 
@@ -13,6 +13,7 @@ def GCP(adj_matrix: np.ndarray) -> list:
 
     Args:
         adj_matrix (np.ndarray): Adjacency matrix representing the graph.
+        resolution (float): The resolution parameter gamma of the modularity. Default is 1.
 
     Returns:
         tuple: A tuple containing the communities (clusters) generated by GCP and the modularity value of the solution.
@@ -27,13 +28,13 @@ def GCP(adj_matrix: np.ndarray) -> list:
     communities = [K0]
     nodes = [v]
 
-    Mdb = -1
+    Mdb = -np.inf
 
     while V:
         v = np.random.choice(V)
         nodes.append(v)
 
-        Mdb = -1
+        Mdb = -np.inf
         best_community = None
         best_community_index = -1
 
@@ -47,7 +48,7 @@ def GCP(adj_matrix: np.ndarray) -> list:
 
             new_communities[i] = Ki_new
 
-            Md = modularity(new_adj_matrix, new_communities)
+            Md = modularity(new_adj_matrix, new_communities, resolution)
 
             if Md > Mdb:
                 Mdb = Md
@@ -56,9 +57,9 @@ def GCP(adj_matrix: np.ndarray) -> list:
 
         if len(nodes) > 1:
             new_adj_matrix = filter_adj_matrix(adj_matrix, nodes)
-            Mdphi = modularity(new_adj_matrix, communities + [[v]])
+            Mdphi = modularity(new_adj_matrix, communities + [[v]], resolution)
         else:
-            Mdphi = -1
+            Mdphi = -np.inf
 
         if Mdb > Mdphi:
             communities[best_community_index] = best_community
@@ -108,7 +109,7 @@ def destruct(adj_matrix: np.ndarray, communities: list, beta: float) -> tuple:
     return removed_nodes, filtered_communities
 
 
-def reconstruct(adj_matrix: np.ndarray, communities: list, removed_nodes: list) -> tuple:
+def reconstruct(adj_matrix: np.ndarray, communities: list, removed_nodes: list, resolution: float = 1.0) -> tuple:
     """
     Reconstructs the communities after removing nodes from the adjacency matrix.
     Each node is assigned to the community that maximizes the modularity.
@@ -117,6 +118,7 @@ def reconstruct(adj_matrix: np.ndarray, communities: list, removed_nodes: list)
         adj_matrix (np.ndarray): The adjacency matrix representing the graph.
         communities (list): The list of communities.
         removed_nodes (list): The list of nodes that have been removed.
+        resolution (float): The resolution parameter gamma of the modularity. Default is 1.
 
     Returns:
         tuple: A tuple containing the reconstructed communities and the modularity score.
@@ -124,10 +126,10 @@ def reconstruct(adj_matrix: np.ndarray, communities: list, removed_nodes: list)
     nodes = [node for node in list(
         range(adj_matrix.shape[0])) if node not in removed_nodes]
 
-    Mdb = -1
+    Mdb = -np.inf
 
     for node in removed_nodes:
-        Mdb = -1
+        Mdb = -np.inf
         best_community = None
         best_community_index = -1
 
@@ -142,16 +144,17 @@ def reconstruct(adj_matrix: np.ndarray, communities: list, removed_nodes: list)
             new_communities = communities.copy()
             new_communities[i] = Ki_new
 
-            Md = modularity(new_adj_matrix, new_communities)
+            Md = modularity(new_adj_matrix, new_communities, resolution)
 
             if Md > Mdb:
                 Mdb = Md
                 best_community = Ki_new
                 best_community_index = i
 
-        Mdphi = modularity(new_adj_matrix, communities)
+        Mdphi = modularity(new_adj_matrix, communities, resolution)
 
-        if Mdb >= Mdphi and Mdb != -1:
+        # no candidate community means no score, whatever the sign of the modularity
+        if best_community is not None and Mdb >= Mdphi:
             communities[best_community_index] = best_community
         else:
             Ki = [node]
@@ -161,7 +164,7 @@ def reconstruct(adj_matrix: np.ndarray, communities: list, removed_nodes: list)
     return communities, Mdb
 
 
-def IG(adj_matrix: np.ndarray, nb_iterations=100, beta=.4) -> tuple:
+def IG(adj_matrix: np.ndarray, nb_iterations=100, beta=.4, resolution=1.0) -> tuple:
     """
     Iterative Greedy Algorithm (IG) for community detection in a network.
 
@@ -169,6 +172,7 @@ def IG(adj_matrix: np.ndarray, nb_iterations=100, beta=.4) -> tuple:
         adj_matrix (np.ndarray): Adjacency matrix of the network.
         nb_iterations (int): Number of iterations for the algorithm. Default is 100.
         beta (float): Beta parameter for the destruction phase. Default is 0.4.
+        resolution (float): The resolution parameter gamma of the modularity, the edge weights are always used. Default is 1.
 
     Returns:
         tuple: A tuple containing the final communities, modularity trace, communities trace, and frames.
@@ -185,7 +189,7 @@ def IG(adj_matrix: np.ndarray, nb_iterations=100, beta=.4) -> tuple:
     modularity_trace = []
     communities_trace = []
 
-    communities, mod = GCP(adj_matrix)
+    communities, mod = GCP(adj_matrix, resolution)
 
     modularity_trace.append(mod)
     communities_trace.append(communities)
@@ -195,9 +199,9 @@ def IG(adj_matrix: np.ndarray, nb_iterations=100, beta=.4) -> tuple:
             adj_matrix, communities, beta)
 
         new_communities, mod = reconstruct(
-            adj_matrix, filtered_communities, removed_nodes)
+            adj_matrix, filtered_communities, removed_nodes, resolution)
 
-        if modularity(adj_matrix, new_communities) > modularity(adj_matrix, communities):
+        if modularity(adj_matrix, new_communities, resolution) > modularity(adj_matrix, communities, resolution):
             communities = new_communities
             modularity_trace.append(mod)
             communities_trace.append(communities)
@@ -1,21 +1,56 @@
-
+import heapq
+import itertools
 import networkx as nx
 import numpy as np
+from scipy import sparse
 from scipy.linalg import eigh
 from sklearn.preprocessing import StandardScaler
 from sklearn.decomposition import PCA
 from sklearn.cluster import KMeans
+from concurrent.futures import ProcessPoolExecutor
 from utils.communities_network import calculate_Q_Sim
+from utils.shared_graph import SharedGraph, attach_worker, worker_graph
 from sklearn.preprocessing import StandardScaler
-import math
 
 
-def similarity_matrix(A: np.ndarray) -> np.ndarray:
+def similarity_matrix(A: np.ndarray, top_k: int = None) -> np.ndarray:
     """
     This function takes an adjacency matrix A and returns the similarity matrix S.
+
+    For a sparse A (or when top_k is given) S = A.A^T is computed as a sparse CSR product, which only
+    visits the pairs of nodes sharing a neighbour. With top_k, each row keeps its diagonal and its top_k
+    largest similarities only (a k-NN similarity graph), so S holds O(N * top_k) values.
+
+    Parameters:
+        A (np.ndarray | scipy.sparse matrix): The (weighted) adjacency matrix.
+        top_k (int): The number of most similar nodes kept per row. Default is None (keep every pair).
+
+    Returns:
+        np.ndarray | scipy.sparse.csr_matrix: The similarity matrix, sparse for a sparse A or when top_k is given.
     """
-    # Calculate the Similarity Matrix S
-    S = np.dot(A, A.T)
+    if not sparse.issparse(A) and top_k is None:
+        # Calculate the Similarity Matrix S
+        S = np.dot(A, A.T)
+        return S
+
+    A = sparse.csr_matrix(A, dtype=np.float64)
+    S = sparse.csr_matrix(A @ A.T)
+    S.sort_indices()
+
+    if top_k is None:
+        return S
+
+    rows = np.repeat(np.arange(S.shape[0]), np.diff(S.indptr))
+    diagonal = rows == S.indices
+
+    # rank of each similarity inside its row (diagonal excluded), largest first
+    order = np.lexsort((-S.data, diagonal, rows))
+    ranks = np.empty(len(order), dtype=np.int64)
+    ranks[order] = np.arange(len(order)) - S.indptr[rows[order]]
+
+    keep = diagonal | (ranks < top_k)
+    S = sparse.csr_matrix((S.data[keep], (rows[keep], S.indices[keep])), shape=S.shape)
+
     return S
 
 
@@ -24,16 +59,28 @@ def distance_matrix2(similarity_matrix):
     Converts an unnormalized similarity matrix to a distance matrix.
     This function first normalizes the similarity scores based on the maximum value found in the matrix.
 
+    A sparse (e.g. top-k) similarity matrix gives a `SparseDistanceMatrix`, where the pairs without a stored
+    similarity are at the maximum distance 1.
+
     Parameters:
-    similarity_matrix (numpy.ndarray): A square matrix containing unnormalized similarity scores.
+    similarity_matrix (numpy.ndarray | scipy.sparse matrix): A square matrix containing unnormalized similarity scores.
 
     Returns:
-    numpy.ndarray: A square matrix containing distance scores.
+    numpy.ndarray | SparseDistanceMatrix: A square matrix containing distance scores.
     """
     # Validate the input matrix is square
     if similarity_matrix.shape[0] != similarity_matrix.shape[1]:
         raise ValueError("The similarity matrix must be square.")
 
+    if sparse.issparse(similarity_matrix):
+        similarity_matrix = sparse.csr_matrix(similarity_matrix, dtype=np.float64)
+
+        # same normalisation as the dense path: column j is divided by the maximum of row j
+        max_similarity = similarity_matrix.max(axis=1).toarray().ravel()
+        max_similarity[max_similarity == 0] = 1
+
+        return SparseDistanceMatrix(similarity_matrix @ sparse.diags(1 / max_similarity))
+
     # Normalize similarity scores by the maximum score in the matrix
     max_similarity = np.max(similarity_matrix, axis=1)
     normalized_similarity = similarity_matrix / max_similarity
@@ -50,6 +97,49 @@ def distance_matrix2(similarity_matrix):
     return distance_matrix
 
 
+class SparseDistanceMatrix:
+    """
+    Distance matrix 1 - N of a sparse normalized similarity matrix N, stored through N only.
+
+    The pairs of nodes without a stored similarity (no shared neighbour, or outside the top-k
+    neighbours) are at the maximum distance 1. Indexing returns dense distances (D[i, j], D[nodes]),
+    N is not symmetric so reading distances to a set of nodes goes through `closest`.
+
+    Attributes:
+        similarity (scipy.sparse.csr_matrix): The normalized similarity matrix N.
+    """
+
+    def __init__(self, similarity):
+        self.similarity = sparse.csr_matrix(similarity)
+        self.shape = self.similarity.shape
+        self._columns = None
+
+    def closest(self, nodes: list) -> np.ndarray:
+        """
+        Returns the distance of every node i to its closest node of nodes, min D[i, t] for t in nodes,
+        from the rows of the transposed similarity matrix (the columns of N).
+        """
+        if self._columns is None:
+            self._columns = sparse.csr_matrix(self.similarity.T)
+
+        return 1 - self._columns[nodes].max(axis=0).toarray().ravel()
+
+    def sums(self, nodes: list) -> np.ndarray:
+        """
+        Returns the sum of the distances from nodes to every node j, the sum of D[s, j] for s in nodes,
+        from the rows of the nodes only.
+        """
+        return len(nodes) - np.asarray(self.similarity[nodes].sum(axis=0)).ravel()
+
+    def __getitem__(self, key):
+        similarity = self.similarity[key]
+
+        if sparse.issparse(similarity):
+            return 1 - similarity.toarray()
+
+        return 1 - similarity
+
+
 def standard_scale(matrix):
     """
     Standardizes the given matrix by applying standard scaling.
@@ -71,29 +161,98 @@ def standard_scale(matrix):
     return scaled_matrix
 
 
-def distance_matrix(S: np.ndarray) -> np.ndarray:
+def distance_matrix(S: np.ndarray, dtype=np.float64, out=None, block_size=2048) -> np.ndarray:
     """
-    This function takes a similarity matrix S and returns the distance matrix D.
+    This function takes a similarity matrix S and returns the distance matrix D, D[i, j] = sqrt(S[i, i] + S[j, j] - 2 * S[i, j]).
+
+    The matrix is computed tile by tile with vectorised operations, so the temporary memory is bounded
+    by one block_size x block_size tile whatever the size of S.
+
+    Parameters:
+        S (np.ndarray | scipy.sparse matrix): The similarity matrix.
+        dtype (np.dtype): The type of the distances, np.float32 halves the memory of D. Default is np.float64.
+        out (str | np.ndarray): Where D is written: an existing N x N array, or the path of a .npy file
+                                created as a memory map for matrices that do not fit in RAM. Default is None (new array).
+        block_size (int): The size of the tiles. Default is 2048.
+
+    Returns:
+        np.ndarray: The distance matrix (a np.memmap when out is a path).
     """
-    # Define the Distance Matrix D
     n = S.shape[0]
 
-    D = np.zeros(S.shape)
+    if out is None:
+        D = np.empty((n, n), dtype=dtype)
+    elif isinstance(out, str):
+        D = np.lib.format.open_memmap(out, mode="w+", dtype=dtype, shape=(n, n))
+    else:
+        D = out
+
+    diagonal = np.asarray(S.diagonal(), dtype=D.dtype)
+
+    for i in range(0, n, block_size):
+        rows = S[i:i + block_size]
+        if sparse.issparse(rows):
+            rows = rows.tocsc()
+
+        for j in range(0, n, block_size):
+            tile = rows[:, j:j + block_size]
+            tile = tile.toarray().astype(D.dtype, copy=False) if sparse.issparse(tile) else np.array(tile, dtype=D.dtype)
+
+            tile *= -2
+            tile += diagonal[i:i + block_size, None]
+            tile += diagonal[None, j:j + block_size]
 
-    for i in range(n):
-        for j in range(n):
-            D[i, j] = math.sqrt(S[i, i] + S[j, j] - 2*S[i, j])
+            # rounding errors can give tiny negative values for identical rows
+            np.maximum(tile, 0, out=tile)
+            D[i:i + block_size, j:j + block_size] = np.sqrt(tile, out=tile)
+
+    if isinstance(D, np.memmap):
+        D.flush()
 
     return D
 
 
+def _csr_submatrix(matrix, nodes: list) -> np.ndarray:
+    """
+    Returns the dense submatrix matrix[nodes][:, nodes] of a CSR matrix, read from the rows of the nodes only.
+    """
+    nodes_array = np.asarray(nodes, dtype=np.int64)
+
+    # positions of the entries of the rows of the nodes in the CSR arrays
+    starts = matrix.indptr[nodes_array]
+    lengths = matrix.indptr[nodes_array + 1] - starts
+    positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+    rows = np.repeat(np.arange(len(nodes_array)), lengths)
+
+    # column of each entry in the submatrix, the entries outside the nodes are dropped
+    order = np.argsort(nodes_array)
+    columns = np.searchsorted(nodes_array[order], matrix.indices[positions])
+    columns[columns == len(nodes_array)] = 0
+    inside = nodes_array[order][columns] == matrix.indices[positions]
+
+    submatrix = np.zeros((len(nodes_array), len(nodes_array)), dtype=matrix.dtype)
+    submatrix[rows[inside], order[columns[inside]]] = matrix.data[positions][inside]
+
+    return submatrix
+
+
 def average_weight(dist_matrix: np.ndarray, nodes: list) -> float:
     """
     This function takes a distance matrix D and a list of nodes and returns the average weight of the nodes.
     specific for complete graphs
+    The submatrix of a sparse matrix, or of the similarity of a `SparseDistanceMatrix`, is read from the CSR
+    rows of the nodes, without going through full rows.
     """
 
-    filtered_dist_matrix = dist_matrix[nodes][:, nodes]
+    if isinstance(dist_matrix, SparseDistanceMatrix):
+        filtered_dist_matrix = 1 - _csr_submatrix(dist_matrix.similarity, nodes)
+    elif sparse.issparse(dist_matrix):
+        if dist_matrix.format != "csr":
+            dist_matrix = sparse.csr_matrix(dist_matrix)
+        filtered_dist_matrix = _csr_submatrix(dist_matrix, nodes)
+    else:
+        filtered_dist_matrix = dist_matrix[nodes][:, nodes]
+
     sum_distances = np.sum(filtered_dist_matrix)  # sum of distances
     nb_edges = len(nodes) * (len(nodes) - 1)   # cause it's a complete graph
 
@@ -106,16 +265,84 @@ def fitness_function(adj_matrix: np.ndarray, nodes: list, alpha=.9, beta=1.1) ->
     It returns the number of edges inside the subgraph divided by the sum of edges inside and coming out of the subgraph.
     """
 
-    subgraph = adj_matrix[nodes][:, nodes]
+    return LocalExpansionState(adj_matrix, nodes).fitness(alpha, beta)
 
-    num_edges_inside = np.count_nonzero(np.triu(subgraph))
 
-    unused_nodes = [node for node in list(
-        range(adj_matrix.shape[0])) if node not in nodes]
+class LocalExpansionState:
+    """
+    Edge counts of a community grown by the local expansion, for its fitness function.
 
-    num_edges_outside = np.count_nonzero(adj_matrix[nodes][:, unused_nodes])
+    The number of edges inside the community (k_in, self-loops included) and going out of it (k_out)
+    are kept up to date when a node v is added, in O(deg(v)) from the CSR rows of the adjacency matrix,
+    instead of extracting the submatrices of the community and of the rest of the graph for each candidate.
 
-    return num_edges_inside / (num_edges_inside**alpha + num_edges_outside**beta)
+    Attributes:
+        nodes (list): The nodes of the community, in the order they were added.
+        k_in (int): The number of edges between nodes of the community.
+        k_out (int): The number of edges between the community and the rest of the graph.
+    """
+
+    def __init__(self, adj_matrix, nodes=()):
+        """
+        Parameters:
+            adj_matrix (np.ndarray | scipy.sparse matrix): The adjacency matrix of the network, only its non-zero
+                                                           entries are used.
+            nodes (list): The initial nodes of the community. Default is empty.
+        """
+        adj_matrix = sparse.csr_matrix(adj_matrix)
+        if np.any(adj_matrix.data == 0):
+            adj_matrix = adj_matrix.copy()
+            adj_matrix.eliminate_zeros()
+
+        self._indptr = adj_matrix.indptr
+        self._indices = adj_matrix.indices
+        self._members = np.zeros(adj_matrix.shape[0], dtype=bool)
+
+        self.nodes = []
+        self.k_in = 0
+        self.k_out = 0
+
+        for node in nodes:
+            self.add(node)
+
+    def __contains__(self, node: int) -> bool:
+        return bool(self._members[node])
+
+    def _counts_with(self, node: int) -> tuple:
+        """
+        Returns k_in and k_out of the community once node is added.
+        """
+        if node in self:
+            return self.k_in, self.k_out
+
+        neighbours = self._indices[self._indptr[node]:self._indptr[node + 1]]
+
+        self_loop = int(np.count_nonzero(neighbours == node))
+        inside = int(np.count_nonzero(self._members[neighbours]))
+        outside = len(neighbours) - self_loop - inside
+
+        # the edges between node and the community were going out of it, they are now inside
+        return self.k_in + inside + self_loop, self.k_out - inside + outside
+
+    def fitness(self, alpha=.9, beta=1.1, node: int = None) -> float:
+        """
+        Returns the fitness k_in / (k_in^alpha + k_out^beta) of the community, or of the community with node
+        added when node is given (the community is not modified).
+        """
+        k_in, k_out = (self.k_in, self.k_out) if node is None else self._counts_with(node)
+
+        return k_in / (k_in**alpha + k_out**beta)
+
+    def add(self, node: int) -> None:
+        """
+        Adds node to the community, in O(deg(node)).
+        """
+        if node in self:
+            return
+
+        self.k_in, self.k_out = self._counts_with(node)
+        self._members[node] = True
+        self.nodes.append(node)
 
 
 def find_cliques(G: nx.Graph, adj_matrix: np.ndarray) -> list:
@@ -136,6 +363,146 @@ def find_cliques(G: nx.Graph, adj_matrix: np.ndarray) -> list:
     return res
 
 
+class _CliqueOrder:
+    """
+    Heap key of a clique in a `CliqueIndex`: the history of its weights, then its initial rank.
+
+    Re-sorting the cliques by weight after each seed with a stable sort breaks the ties with the previous
+    order, so the cliques end up ordered by their current weight, then by their weight before the last
+    seed, and so on back to their initial rank. The history is kept as (round, weight) segments, the
+    weight of a clique holding until its next segment. A key is never modified: comparing two keys
+    extends both with their last weight, so the order of the entries of a heap does not change.
+    """
+
+    __slots__ = ("history", "rank")
+
+    def __init__(self, history: tuple, rank: int):
+        self.history = history
+        self.rank = rank
+
+    def __lt__(self, other: "_CliqueOrder") -> bool:
+        i, j = len(self.history) - 1, len(other.history) - 1
+
+        # walk back the rounds from the latest one, the heaviest clique comes first
+        while i >= 0 and j >= 0:
+            (start, weight), (other_start, other_weight) = self.history[i], other.history[j]
+            if weight != other_weight:
+                return weight > other_weight
+            if start >= other_start:
+                i -= 1
+            if other_start >= start:
+                j -= 1
+
+        return self.rank < other.rank
+
+    def __eq__(self, other: "_CliqueOrder") -> bool:
+        return not self < other and not other < self
+
+
+class CliqueIndex:
+    """
+    The cliques still available to the local expansion, indexed by node.
+
+    Each node has a posting list of the cliques containing it, kept as a lazy heap ordered by weight
+    (largest first, ties broken by the order of the cliques before their last re-weighting, see
+    `_CliqueOrder`). When the nodes of a community are removed, only the cliques containing one of
+    them are filtered and re-weighted: their new entries are pushed on the heaps of their remaining
+    nodes, and the outdated entries are dropped when they reach the top of a heap. Seeding K
+    communities then costs time proportional to the affected cliques instead of re-weighting and
+    sorting every clique K times.
+    """
+
+    def __init__(self, cliques: list):
+        """
+        Parameters:
+            cliques (list): The cliques ({"nodes": list, "weight": float}) sorted by decreasing weight.
+        """
+        self.cliques = [list(clique["nodes"]) for clique in cliques]
+        self._alive = np.ones(len(cliques), dtype=bool)
+        self._versions = np.zeros(len(cliques), dtype=np.int64)
+        self._nb_alive = len(cliques)
+
+        # (round, weight) segments of each clique, the rank of a clique is also its index
+        self._round = 0
+        self._histories = [((0, clique["weight"]),) for clique in cliques]
+
+        # heap entries: (order, version)
+        self._postings = {}
+        for rank, clique in enumerate(cliques):
+            entry = (_CliqueOrder(self._histories[rank], rank), 0)
+            for node in clique["nodes"]:
+                self._postings.setdefault(node, []).append(entry)
+
+        for heap in self._postings.values():
+            heapq.heapify(heap)
+
+    def __len__(self) -> int:
+        return self._nb_alive
+
+    def best(self, node: int) -> int:
+        """
+        Returns the index of the heaviest available clique containing node, None if there is none.
+        """
+        heap = self._postings.get(node, [])
+
+        while heap:
+            order, version = heap[0]
+            if self._alive[order.rank] and self._versions[order.rank] == version:
+                return order.rank
+            heapq.heappop(heap)
+
+        return None
+
+    def pop(self, rank: int) -> list:
+        """
+        Removes a clique from the index and returns its nodes.
+        """
+        self._alive[rank] = False
+        self._nb_alive -= 1
+
+        return self.cliques[rank]
+
+    def remove_nodes(self, nodes: list, weight_matrix, reweight_all=False) -> None:
+        """
+        Removes nodes from the cliques containing them, drops the cliques left with 2 nodes or less, and
+        re-weights the others with `average_weight` on weight_matrix.
+
+        Parameters:
+            nodes (list): The nodes to remove.
+            weight_matrix (np.ndarray | scipy.sparse matrix): The matrix of the new weights.
+            reweight_all (bool): Re-weight every available clique, not only the affected ones. Default is False.
+        """
+        removed = set(nodes)
+        self._round += 1
+
+        if reweight_all:
+            affected = np.flatnonzero(self._alive)
+        else:
+            affected = {order.rank for node in removed for order, _ in self._postings.get(node, [])
+                        if self._alive[order.rank]}
+
+        for node in removed:
+            self._postings.pop(node, None)
+
+        for rank in sorted(affected):
+            clique = [node for node in self.cliques[rank] if node not in removed]
+            self.cliques[rank] = clique
+
+            if len(clique) <= 2:
+                self._alive[rank] = False
+                self._nb_alive -= 1
+                continue
+
+            weight = average_weight(weight_matrix, clique)
+            if weight != self._histories[rank][-1][1]:
+                self._histories[rank] += ((self._round, weight),)
+
+            self._versions[rank] += 1
+            entry = (_CliqueOrder(self._histories[rank], rank), self._versions[rank])
+            for node in clique:
+                heapq.heappush(self._postings[node], entry)
+
+
 def filter_matrix(matrix: np.ndarray, V: list) -> np.ndarray:
     """
     Filters the adjacency matrix by keeping only the nodes in V.
@@ -157,63 +524,67 @@ def filter_matrix(matrix: np.ndarray, V: list) -> np.ndarray:
     return new_matrix
 
 
-def local_expension(G: nx.Graph, D: np.ndarray, k=2, alpha=.9, beta=1.1):
+def local_expension_seeds(G: nx.Graph, D: np.ndarray, alpha=.9, beta=1.1):
     """
-    This function takes a graph G and returns a list of k initial seeds.
+    This function takes a graph G and yields the initial seeds of the local expansion one after the other.
+
+    The seeds chosen for k clusters do not depend on k, so the first k seeds of the sequence are the
+    seeds of `local_expension` for k, and a sweep over k can seed once for its largest k.
+    The sequence ends when every node was selected.
     """
 
-    adj_matrix = nx.to_numpy_array(G)
+    adj_matrix = nx.to_scipy_sparse_array(G, format="csr")
     initial_seeds = []
 
     # find all complete subgraphs of size 3 or more in the graph
     cliques = find_cliques(G, D)
 
-    # sort the cliques by their weight
+    # sort the cliques by their weight, and index them by node
     cliques_sorted = sorted(cliques, key=lambda x: x["weight"], reverse=True)
+    clique_index = CliqueIndex(cliques_sorted)
 
     # get the unselected nodes
     unselected_nodes = set(G.nodes())
-    skip_nodes = []
+    skip_nodes = set()
 
-    M = 0
-    while M < k and cliques_sorted:
+    while clique_index:
 
         # get the node with the maximum degree
         max_degree_node = max(unselected_nodes, key=lambda node:  G.degree(
             node) * int(node not in skip_nodes))
 
-        chosen_clique = None
-        chosen_clique_index = -1
         # get the clique that contains the node with the maximum degree
-        for i, clique in enumerate(cliques_sorted):
-            if max_degree_node in clique["nodes"]:
-                chosen_clique_index = i
-                chosen_clique = clique["nodes"]
-                break
+        chosen_clique_index = clique_index.best(max_degree_node)
 
         # if the node with the maximum degree is not in any clique we skip it in next iteration
-        if not chosen_clique:
-            skip_nodes.append(max_degree_node)
+        if chosen_clique_index is None:
+            skip_nodes.add(max_degree_node)
             continue
 
-        cliques_sorted.pop(chosen_clique_index)
+        chosen_clique = clique_index.pop(chosen_clique_index)
 
         # sort the nodes in the clique by their distance to the other nodes in the clique
+        if isinstance(D, SparseDistanceMatrix):
+            closest_distance = D.closest(chosen_clique)
+        else:
+            closest_distance = np.min(D[:, chosen_clique], axis=1)
         condidat_nodes_in_order = sorted(
-            unselected_nodes, key=lambda node: min(D[node, target_node] for target_node in chosen_clique))
+            unselected_nodes, key=lambda node: closest_distance[node])
 
         # get the initial fitness value of the chosen clique
-        fitness_value = fitness_function(adj_matrix, chosen_clique)
+        community = LocalExpansionState(adj_matrix, chosen_clique)
+        fitness_value = community.fitness()
 
         # add the nodes that maximizes the fitness function to the chosen clique
         for node in condidat_nodes_in_order:
-            if node not in chosen_clique:
-                fitness = fitness_function(
-                    adj_matrix, chosen_clique + [node], alpha, beta)
+            if node not in community:
+                fitness = community.fitness(alpha, beta, node)
 
                 if fitness >= fitness_value:
                     fitness_value = fitness
-                    chosen_clique.append(node)
+                    community.add(node)
+
+        chosen_clique = community.nodes
 
         # get the subgraph of the chosen clique
         H = G.subgraph(chosen_clique)
@@ -227,49 +598,64 @@ def local_expension(G: nx.Graph, D: np.ndarray, k=2, alpha=.9, beta=1.1):
 
         # add the centroid to the initial seeds
         initial_seeds.append(centroid)
+        yield centroid
 
         # remove the nodes in the chosen clique from the unselected nodes
         unselected_nodes.difference_update(chosen_clique)
 
-        # remove the treeted nodes from the cliques list
-        new_cliques = []
-        for clique in cliques_sorted:
-            clique["nodes"] = [node for node in clique["nodes"]
-                               if node in unselected_nodes]
-            clique["weight"] = average_weight(adj_matrix, clique["nodes"])
+        # remove the treeted nodes from the cliques containing them, the cliques ranked by distance
+        # after find_cliques are re-weighted with the adjacency matrix once the first seed is chosen
+        clique_index.remove_nodes(chosen_clique, adj_matrix, reweight_all=len(initial_seeds) == 1)
 
-            if len(clique["nodes"]) > 2:
-                new_cliques.append(clique)
-
-        # sort the new cliques according to their weight
-        cliques_sorted = sorted(
-            new_cliques, key=lambda x: x["weight"], reverse=True)
+    # when there are no more cliques we add the nodes with the maximum distance to the initial seeds
+    while unselected_nodes:
+        if isinstance(D, SparseDistanceMatrix):
+            distance_sums = D.sums(initial_seeds)
+            max_distance_seed = max(
+                unselected_nodes, key=lambda node: distance_sums[node])
+        else:
+            seed_distances = D[initial_seeds]
+            max_distance_seed = max(
+                unselected_nodes, key=lambda node: np.sum(seed_distances[:, node]))
+        initial_seeds.append(max_distance_seed)
+        unselected_nodes.remove(max_distance_seed)
 
-        M += 1
+        yield max_distance_seed
 
-    # if the number of initial seeds is less than k we add the nodes with the maximum distance to the initial seeds
-    if M < k:
-        for _ in range(k-M):
 
-            if not unselected_nodes:
-                raise ValueError("No more nodes to select , k is too large")
+def local_expension(G: nx.Graph, D: np.ndarray, k=2, alpha=.9, beta=1.1):
+    """
+    This function takes a graph G and returns a list of k initial seeds.
+    """
 
-            max_distance_seed = max(
-                unselected_nodes, key=lambda node: np.sum(D[initial_seeds][:, node]))
-            initial_seeds.append(max_distance_seed)
-            unselected_nodes.remove(max_distance_seed)
+    initial_seeds = list(itertools.islice(local_expension_seeds(G, D, alpha, beta), k))
 
-            M += 1
+    if len(initial_seeds) < k:
+        raise ValueError("No more nodes to select , k is too large")
 
     return initial_seeds
 
 
-def PCA_reduction(D: np.ndarray, epsilon=10e-4) -> np.ndarray:
+def PCA_reduction(D: np.ndarray, epsilon=10e-4, variance=.90, max_components=100) -> np.ndarray:
     """
     This function takes a distance matrix D and returns the reduced matrix using PCA.
+
+    A `SparseDistanceMatrix` is reduced with a PCA of its sparse similarity N instead: once the columns are
+    centered, 1 - N and -N are the same matrix, so up to the signs of the components this is the PCA of D.
+    The arpack solver centers N implicitly (scikit-learn >= 1.4), so N is never densified. The first components
+    explaining the given share of the variance are kept, at most max_components.
     """
+    if isinstance(D, SparseDistanceMatrix) or sparse.issparse(D):
+        similarity = D.similarity if isinstance(D, SparseDistanceMatrix) else D
 
-    pca = PCA(n_components=.90)
+        pca = PCA(n_components=min(max_components, min(similarity.shape) - 1), svd_solver="arpack", random_state=0)
+        X = pca.fit_transform(similarity)
+
+        # same cut as PCA(n_components=variance)
+        nb_components = np.searchsorted(np.cumsum(pca.explained_variance_ratio_), variance, side="right") + 1
+        return X[:, :nb_components]
+
+    pca = PCA(n_components=variance)
     X = pca.fit_transform(D)
 
     # positive_indices = np.where(eigenvalues > epsilon)[0]
@@ -301,18 +687,21 @@ def calculate_modularity(G: nx.Graph, communities: list) -> float:
     return nx.community.modularity(G, communities)
 
 
-def local_expansion_kmeans(G: nx.Graph, A: np.ndarray, Kmin: int, Kmax: int, metric="Mod", alpha=.9, beta=1.1) -> list:
+def local_expansion_kmeans(G: nx.Graph, A: np.ndarray, Kmin: int, Kmax: int, metric="Mod", alpha=.9, beta=1.1,
+                           top_k=None, distance=distance_matrix2) -> list:
     """
     This function implements the local expansion k-means algorithm.
     It takes a weighted adjacency matrix A, minimum number of clusters Kmin, and maximum number of clusters Kmax.
     It returns the community set Cmax.
+    With a sparse A or top_k, the similarities and distances stay sparse (see `similarity_matrix`).
+    The distance function turns the similarity matrix into the distance matrix, `distance_matrix2` by default.
     """
 
     # Calculate the similarity matrix S using the weighted adjacency matrix A
-    S = similarity_matrix(A)
+    S = similarity_matrix(A, top_k)
 
     # Calculate the distance matrix D using S
-    D = distance_matrix2(S)
+    D = distance(S)
 
     D_transformed = PCA_reduction(D)
 
@@ -325,12 +714,17 @@ def local_expansion_kmeans(G: nx.Graph, A: np.ndarray, Kmin: int, Kmax: int, met
     Mod = -1
     Modsim = -1
 
+    # the initial seeds for K are the first K seeds of the local expansion, computed once for Kmax
+    seeds = list(itertools.islice(local_expension_seeds(G, D, alpha, beta), Kmax))
+
     # iterate from Kmin to Kmax to find the best number of clusters accoriding to the choosed matrix either Mod or QSim
     for K in range(Kmin, Kmax + 1):
         try:
 
             # get the initial seeds using the local expansion algorithm
-            initial_seeds = local_expension(G, D, K, alpha, beta)
+            if K > len(seeds):
+                raise ValueError("No more nodes to select , k is too large")
+            initial_seeds = seeds[:K]
 
             # apply the kmeans clustering algorithm
             communities, labels = kmeans_clustering(
@@ -363,6 +757,102 @@ def local_expansion_kmeans(G: nx.Graph, A: np.ndarray, Kmin: int, Kmax: int, met
     return Cmax, Qmax, Kbest, labelsBest, trace
 
 
+# networkx graph rebuilt once by each worker of local_expansion_kmeans_parallel
+_worker_network = None
+
+
+def _attach_kmeans_worker(handle: dict) -> None:
+    """
+    Worker initializer: attaches the shared graph and reduced distance matrix, and rebuilds the networkx graph once.
+    """
+    global _worker_network
+
+    attach_worker(handle)
+    _worker_network = nx.from_scipy_sparse_array(worker_graph().adj_matrix)
+
+
+def _local_expansion_kmeans_task(K: int, initial_seeds: list) -> tuple:
+    """
+    Runs the k-means clustering for one number of clusters K from its initial seeds in a worker.
+    """
+    graph = worker_graph()
+    D_transformed = graph.arrays["D_transformed"]
+
+    communities, labels = kmeans_clustering(
+        D_transformed, K, D_transformed[initial_seeds])
+
+    Mod = calculate_modularity(_worker_network, communities)
+    Modsim = calculate_Q_Sim(graph.adj_matrix, communities)
+
+    return communities, labels, Mod, Modsim
+
+
+def local_expansion_kmeans_parallel(G: nx.Graph, A: np.ndarray, Kmin: int, Kmax: int, metric="Mod", alpha=.9, beta=1.1,
+                                    top_k=None, max_workers=None, distance=distance_matrix2) -> list:
+    """
+    Parallel version of `local_expansion_kmeans`, the k-means clustering of each number of clusters K runs in
+    a worker process.
+
+    The seeds are computed once for Kmax in the main process, the seeds for K being the first K of them.
+    The adjacency matrix is shared with the workers as CSR arrays, and the reduced distance matrix as a
+    dense array, through a `SharedGraph`: each worker attaches them once instead of receiving a pickled
+    copy per task, and rebuilds the networkx graph from the CSR arrays.
+    The nodes of G must be the integers 0..N-1 in the order of A.
+    The distance function turns the similarity matrix into the distance matrix, `distance_matrix2` by default
+    (the former runner of kmeans_parallel.ipynb used `distance_matrix`).
+
+    Returns the same values as `local_expansion_kmeans`.
+    """
+
+    # Calculate the similarity matrix S using the weighted adjacency matrix A
+    S = similarity_matrix(A, top_k)
+
+    # Calculate the distance matrix D using S
+    D = distance(S)
+
+    D_transformed = PCA_reduction(D)
+
+    Cmax = []
+    Qmax = -1
+    Kbest = Kmin
+    labelsBest = []
+    trace = []
+
+    # the initial seeds for K are the first K seeds of the local expansion, computed once for Kmax
+    seeds = list(itertools.islice(local_expension_seeds(G, D, alpha, beta), Kmax))
+
+    with SharedGraph(A, D_transformed=D_transformed) as graph, \
+            ProcessPoolExecutor(max_workers, initializer=_attach_kmeans_worker, initargs=(graph.handle,)) as executor:
+        futures = {K: executor.submit(_local_expansion_kmeans_task, K, seeds[:K])
+                   for K in range(Kmin, min(Kmax, len(seeds)) + 1)}
+
+        for K in range(Kmin, Kmax + 1):
+            try:
+                if K not in futures:
+                    raise ValueError("No more nodes to select , k is too large")
+                communities, labels, Mod, Modsim = futures[K].result()
+            except Exception as e:
+                print(e)
+                for pending in futures.values():
+                    pending.cancel()
+                break
+
+            Qs = Mod if metric == "Mod" else Modsim
+
+            # just for printing the trace
+            trace += [{"communities": communities, "K": K,
+                       "Modularity": Mod, "Similarity-Based Modularity": Modsim, "labels": Mod}]
+
+            # choose the best number of clusters according to the choosed metric K
+            if Qs > Qmax:
+                Qmax = Qs
+                Cmax = communities
+                Kbest = K
+                labelsBest = labels
+
+    return Cmax, Qmax, Kbest, labelsBest, trace
+
+
 def kmeans_random(G: nx.Graph, A: np.ndarray, Kmin: int, Kmax: int, metric="Mod") -> list:
     """
     This function implements the local expansion k-means algorithm.